@@ -0,0 +1,148 @@
+import hashlib
+import os
+import time
+import numpy as np
+from projects import project_path
+
+# Brute force is fast enough below this many vectors
+ANN_MIN_ROWS = int(os.environ.get('LOCZ_ANN_MIN_ROWS', 200000))
+# Lists probed per query - the recall/latency knob (higher = better recall, slower)
+ANN_NPROBE = int(os.environ.get('LOCZ_ANN_NPROBE', 32))
+ANN_ENABLED = os.environ.get('LOCZ_ANN', '1') == '1'
+
+# Persisted next to each project's shard (translations.ivf.npz for the default)
+ANN_SUFFIX = '.ivf.npz'
+
+KMEANS_ITERATIONS = 12
+TRAIN_SAMPLE = 100000
+ASSIGN_CHUNK = 65536
+
+
+def ann_path(project):
+    return project_path(project, ANN_SUFFIX)
+
+
+def fingerprint(str_ids):
+    """Identify the exact row order an index was built for"""
+    digest = hashlib.sha1()
+    for str_id in str_ids:
+        digest.update(str(str_id).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _assign(matrix, centroids):
+    """Nearest centroid (by cosine) for every row, in chunks to bound memory"""
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_CHUNK):
+        block = matrix[start:start + ASSIGN_CHUNK] @ centroids.T
+        labels[start:start + ASSIGN_CHUNK] = np.argmax(block, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Inverted-file index over a normalized embedding matrix.
+
+    Rows are clustered with spherical k-means; a query only scores the rows
+    in its nprobe closest lists. Row numbers refer to the EmbeddingIndex the
+    IVF was built from, identified by row_count and fingerprint.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows, row_count, row_fingerprint):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.row_count = row_count
+        self.fingerprint = row_fingerprint
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, str_ids, nlist=None, seed=0):
+        start = time.perf_counter()
+        n = len(matrix)
+        nlist = nlist or max(1, min(4096, n, int(4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+
+        sample = matrix
+        if n > TRAIN_SAMPLE:
+            sample = matrix[rng.choice(n, TRAIN_SAMPLE, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            labels = _assign(sample, centroids)
+            counts = np.bincount(labels, minlength=nlist)
+
+            # Per-list sums via one sort + reduceat instead of a Python loop
+            order = np.argsort(labels, kind='stable')
+            present, starts = np.unique(labels[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+
+            # Reseed empty lists from random samples
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        labels = _assign(matrix, centroids)
+        list_rows = np.argsort(labels, kind='stable').astype(np.int64)
+        counts = np.bincount(labels, minlength=nlist)
+        list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        print(f"🗂️ Built IVF index: {n} vectors in {nlist} lists ({time.perf_counter() - start:.1f}s)")
+        return cls(centroids, list_offsets, list_rows, n, fingerprint(str_ids))
+
+    def candidates(self, query, nprobe=ANN_NPROBE):
+        """Row numbers in the nprobe lists closest to the query"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        return np.concatenate([
+            self.list_rows[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probe
+        ])
+
+    def save(self, path):
+        # Write next to the target and swap, so a crash never leaves half a file
+        tmp_path = path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+            row_count=np.array(self.row_count),
+            fingerprint=np.array(self.fingerprint)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a persisted index, returns None if there isn't a usable one"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(
+                    data['centroids'],
+                    data['list_offsets'],
+                    data['list_rows'],
+                    int(data['row_count']),
+                    str(data['fingerprint'])
+                )
+        except Exception as e:
+            print(f"❌ Could not load IVF index: {e}")
+            return None
+
+
+def remove_ann_index(path):
+    """Drop the persisted index once the data it describes is gone"""
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,167 +1,191 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import sqlite3
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from db import get_connection, get_pool_stats, register_schema
+from projects import (DEFAULT_PROJECT, current_project, use_project, project_from_request,
+                      project_exists, list_projects, prepare_project)
 import pandas as pd
-import tempfile
 from datetime import datetime
-import json
+from ingest import read_excel_chunks, insert_translation_chunks, merge_translation_chunks
+from search_index import init_search_index, search_clause, suspend_search_index, resume_search_index
+from listing import bump_data_version, count_rows, fetch_page, fetch_ranked_page
+from export import EXPORT_FORMATS, has_modified_rows, iter_export
+from bulk_edit import parse_updates, apply_translation_updates, update_translation_text
+from embedding_cache import init_embedding_cache
+from embedding_pipeline import embed_rows
+from embedding_model import get_model, encode_texts, warm_up_model, get_model_stats
+from embedding_index import get_embedding_index
+from ann_index import remove_ann_index, ann_path
+from vector_store import init_vector_store, remove_other_sessions, sweep_vector_files, compact_session
+from tfidf_neighbours import iter_tfidf_neighbours, MIN_SCORE
+from jobs import job_scheduler, JobCancelled, PRIORITY_NORMAL, PRIORITY_BULK, ACTIVE_STATES
+from progress import progress_board
+from similarity_cache import similarity_cache
+from fuzzy_match import find_fuzzy_matches, get_fuzzy_index
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import threading
+import json
 import time
-from sentence_transformers import SentenceTransformer
 import re
+import os
 
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 1000 * 1024 * 1024  # 1000GB max file size
 
-similarity_model = None
-processing_threads = {}
+# Background work started by an upload; a newer upload cancels what's left of it
+UPLOAD_JOB_KINDS = ('similarities', 'embeddings')
+SUPERSEDE_TIMEOUT = 30
 
-def get_similarity_model():
-    global similarity_model
-    if similarity_model is None:
-        try:
-            similarity_model = SentenceTransformer('all-MiniLM-L6-v2')
-            print("✅ Sentence Transformer model loaded")
-        except Exception as e:
-            print(f"❌ Could not load Sentence Transformer: {e}")
-            similarity_model = False
-    return similarity_model if similarity_model else None
+# Progress streams: fewest seconds between events, keep-alive comment interval,
+# and how long one stream lives before the browser reconnects
+STREAM_MIN_INTERVAL = 0.25
+STREAM_KEEPALIVE = 15
+STREAM_MAX_SECONDS = 600
+# Ranked similarity listings; the default keeps the old top 300
+SIMILARITY_RESULTS = 300
+MAX_SIMILARITY_RESULTS = 10000
+
+def set_embedding_state(session_id, state, error=None):
+    """Record how an embedding run ended; only 'complete' counts as complete"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE processing_status 
+        SET state = ?, error = ?, is_complete = ?
+        WHERE session_id = ?
+    ''', (state, error, int(state == 'complete'), session_id))
+    conn.commit()
+    conn.close()
+    progress_board.update(current_project(), state=state, error=error)
 
-def process_embeddings_background(session_id):
-    """Background task to compute embeddings for similarity search"""
+def process_embeddings_background(session_id, project=DEFAULT_PROJECT, job=None):
+    """Background task to compute embeddings for similarity search.
+
+    Only the session's strings without a vector are embedded, so the same run
+    handles a fresh upload, an incremental one (the upload drops the changed
+    strings' vectors) and resuming after a restart.
+    """
+    use_project(project)
+    embedding_index = get_embedding_index(project)
     try:
-        print(f"🚀 Starting embedding processing for session {session_id}")
+        print(f"🚀 Starting embedding processing for {project} session {session_id}")
         
-        conn = sqlite3.connect('translations.db')
+        conn = get_connection()
         cursor = conn.cursor()
+
+        # Vectors of other sessions can only be leftovers of a superseded run
+        if remove_other_sessions(cursor, session_id):
+            embedding_index.invalidate()
+        conn.commit()
+        sweep_vector_files(cursor, project)
         
-        # Get all translations for this session
+        cursor.execute('SELECT COUNT(*) FROM translations WHERE upload_session = ?', (session_id,))
+        total = cursor.fetchone()[0]
         cursor.execute('''
-            SELECT str_id, en_text, it_text 
-            FROM translations 
+            SELECT str_id, en_text 
+            FROM translations t
             WHERE upload_session = ?
+              AND NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.str_id = t.str_id)
         ''', (session_id,))
-        
         rows = cursor.fetchall()
-        total = len(rows)
+        done = total - len(rows)
         
         if total == 0:
+            conn.commit()
             conn.close()
             return
         
-        # Initialize processing status
+        # Initialize processing status; the vectors already stored are the checkpoint
         cursor.execute('''
             INSERT OR REPLACE INTO processing_status 
-            (session_id, total_strings, processed_strings, is_complete)
-            VALUES (?, ?, 0, 0)
-        ''', (session_id, total))
+            (session_id, total_strings, processed_strings, is_complete, state)
+            VALUES (?, ?, ?, 0, 'running')
+        ''', (session_id, total, done))
         conn.commit()
-        
-        # Clear old embeddings for this session
-        cursor.execute('DELETE FROM embeddings WHERE upload_session = ?', (session_id,))
-        conn.commit()
-        
-        # Load the model
-        try:
-            from sentence_transformers import SentenceTransformer
-            model = SentenceTransformer('all-MiniLM-L6-v2')
-            print("✅ Sentence Transformer model loaded")
-        except Exception as e:
-            print(f"❌ Could not load model: {e}")
-            # Mark as complete even if failed
-            cursor.execute('''
-                UPDATE processing_status 
-                SET is_complete = 1, processed_strings = total_strings
-                WHERE session_id = ?
-            ''', (session_id,))
-            conn.commit()
-            conn.close()
-            return
-        
-        # Process in batches
-        batch_size = 150
-        processed = 0
-        
-        for i in range(0, total, batch_size):
-            batch = rows[i:i+batch_size]
-            
-            # Prepare texts for embedding
-            texts = []
-            batch_data = []
-            
-            for str_id, en_text, it_text in batch:
-                # I don't want embedding of combined text, only English for simplicity
-                # combined_text = f"{en_text or ''} {it_text or ''}".strip()
-                combined_text = (en_text or '').strip()
-                texts.append(combined_text)
-                batch_data.append((str_id, combined_text))
-            
-            # Compute embeddings for this batch
-            embeddings = model.encode(texts, show_progress_bar=False)
-            
-            # Store embeddings in database
-            for j, (str_id, text) in enumerate(batch_data):
-                embedding_blob = embeddings[j].tobytes()
-                cursor.execute('''
-                    INSERT INTO embeddings (str_id, embedding, upload_session)
-                    VALUES (?, ?, ?)
-                ''', (str_id, embedding_blob, session_id))
-            
-            processed += len(batch)
-
-            # MEMORY CLEANUP
-            del embeddings
-            del texts
-            import gc
-            gc.collect()
-            
-            # Update progress
-            cursor.execute('''
-                UPDATE processing_status 
-                SET processed_strings = ?
-                WHERE session_id = ?
-            ''', (processed, session_id))
-            conn.commit()
-            
-            print(f"📊 Processed {processed}/{total} embeddings ({processed/total*100:.1f}%)")
+        conn.close()
+        progress_board.update(project, session_id=session_id, state='running', error=None, total=total,
+                              processed=done, cache_hits=0, cache_misses=0, strings_per_second=0)
+        
+        if rows:
+            if get_model() is None:
+                raise RuntimeError('Embedding model is not available')
+            if done:
+                print(f"♻️ {done}/{total} strings already embedded, embedding the remaining {len(rows)}")
             
-            # Small delay to prevent overwhelming the system
-            time.sleep(0.1)
+            # Only English is embedded; the pipeline writes vectors and progress as it goes
+            if job:
+                job.set_progress(done, total)
+            stats = embed_rows(rows, session_id, project, job=job,
+                               on_written=embedding_index.notify_added, already_done=done)
+            print(f"✅ Embedding processing complete for session {session_id}: {stats['processed']} strings "
+                  f"in {stats['seconds']}s ({stats['strings_per_second']} strings/s)")
         
         # Mark as complete
-        cursor.execute('''
-            UPDATE processing_status 
-            SET is_complete = 1
-            WHERE session_id = ?
-        ''', (session_id,))
-        conn.commit()
-        
-        print(f"✅ Embedding processing complete for session {session_id}")
-        conn.close()
+        set_embedding_state(session_id, 'complete')
         
+    except JobCancelled:
+        print(f"🛑 Embedding processing cancelled for session {session_id}")
+        set_embedding_state(session_id, 'cancelled')
+        raise
     except Exception as e:
         print(f"❌ Embedding processing failed: {e}")
-        # Mark as complete even if failed
+        # Search keeps working on the vectors that were stored, but knows they're partial
         try:
-            conn = sqlite3.connect('translations.db')
-            cursor = conn.cursor()
+            set_embedding_state(session_id, 'failed', str(e))
+        except Exception:
+            pass
+        raise
+
+    # The run itself is done; a failure from here on only costs disk space or search speed
+    try:
+        # Incremental uploads leave replaced vectors behind in the file
+        conn = get_connection()
+        if compact_session(conn, project, session_id):
+            embedding_index.invalidate()
+            remove_ann_index(ann_path(project))
+            sweep_vector_files(conn.cursor(), project)
+
+        # Big projects get an ANN index, built here so no request waits for it
+        embedding_index.refresh(conn)
+        conn.close()
+        embedding_index.build_ann()
+    except Exception as e:
+        print(f"⚠️ Vector maintenance failed for session {session_id}: {e}")
+
+def resume_embeddings():
+    """Pick up embedding runs that a restart cut short, in every project"""
+    for project in list_projects():
+        conn = get_connection(project)
+        cursor = conn.cursor()
+        # Nothing is running yet, so 'running' means the process died mid-run
+        cursor.execute("UPDATE processing_status SET state = 'interrupted', is_complete = 0 WHERE state = 'running'")
+        conn.commit()
+        if cursor.rowcount:
+            progress_board.update(project, state='interrupted')
+        
+        cursor.execute('SELECT upload_session FROM translations ORDER BY id DESC LIMIT 1')
+        latest = cursor.fetchone()
+        resume = False
+        if latest:
+            session_id = latest[0]
             cursor.execute('''
-                UPDATE processing_status 
-                SET is_complete = 1
-                WHERE session_id = ?
+                SELECT 1 FROM translations t
+                WHERE upload_session = ?
+                  AND NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.str_id = t.str_id)
+                LIMIT 1
             ''', (session_id,))
-            conn.commit()
-            conn.close()
-        except:
-            pass
-# Database setup
-def init_db():
-    conn = sqlite3.connect('translations.db')
-    cursor = conn.cursor()
-    
+            missing = cursor.fetchone() is not None
+            cursor.execute('SELECT state FROM processing_status WHERE session_id = ?', (session_id,))
+            status = cursor.fetchone()
+            # A run someone cancelled stays cancelled
+            resume = missing and (status is None or status[0] != 'cancelled')
+        conn.close()
+        
+        if resume:
+            print(f"♻️ Resuming embeddings for {project} session {session_id}")
+            job_scheduler.submit('embeddings', process_embeddings_background, (session_id, project),
+                                 project=project, priority=PRIORITY_BULK)
+
+# Database setup, run on every project shard the first time it is opened
+def init_db(cursor):
     # Main translations table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS translations (
@@ -175,26 +199,37 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_translations_str_id ON translations(str_id)')
+
+    # Full-text index for the table search box
+    init_search_index(cursor)
     
-    # Similarity cache table
+    # The JSON neighbour lists similar_strings replaced can be large, don't carry them along
+    cursor.execute('DROP TABLE IF EXISTS similarity_cache')
+
+    # TF-IDF neighbours, one row per (string, rank) clustered by str_id so a
+    # lookup is a single range read that comes back in score order
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS similarity_cache (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            str_id TEXT,
-            similar_ids TEXT,
-            upload_session TEXT
-        )
+        CREATE TABLE IF NOT EXISTS similar_strings (
+            str_id TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbour_str_id TEXT NOT NULL,
+            score REAL NOT NULL,
+            upload_session TEXT,
+            PRIMARY KEY (str_id, rank)
+        ) WITHOUT ROWID
     ''')
 
     cursor.execute('''
       CREATE TABLE IF NOT EXISTS embeddings (
           id INTEGER PRIMARY KEY AUTOINCREMENT,
           str_id TEXT NOT NULL,
-          embedding BLOB,
           upload_session TEXT,
+          vector_row INTEGER,
           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
       )  
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_str_id ON embeddings(str_id)')
 
     cursor.execute('''
        CREATE TABLE IF NOT EXISTS processing_status (
@@ -205,51 +240,158 @@ def init_db():
            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
        ) 
     ''')
-    
-    conn.commit()
-    conn.close()
 
-# Initialize database on startup
-init_db()
+    # Columns added after the table was first released
+    cursor.execute('PRAGMA table_info(processing_status)')
+    status_columns = {row[1] for row in cursor.fetchall()}
+    for column, definition in (('cache_hits', 'INTEGER DEFAULT 0'), ('cache_misses', 'INTEGER DEFAULT 0'),
+                               ('strings_per_second', 'REAL DEFAULT 0'), ('state', 'TEXT'), ('error', 'TEXT')):
+        if column not in status_columns:
+            cursor.execute(f'ALTER TABLE processing_status ADD COLUMN {column} {definition}')
+    # Runs from before states were recorded
+    cursor.execute('''
+        UPDATE processing_status
+        SET state = CASE WHEN is_complete = 1 THEN 'complete' ELSE 'interrupted' END
+        WHERE state IS NULL
+    ''')
+
+    init_embedding_cache(cursor)
+    init_vector_store(cursor)
+
+register_schema(init_db)
+
+# Job state changes and progress wake the project's progress streams
+job_scheduler.add_listener(lambda job: progress_board.touch(job.project))
+
+# Initialize the default project's database on startup
+get_connection(DEFAULT_PROJECT).close()
+
+def start_background_work():
+    """Warm up the model and resume interrupted runs; call once, from the serving process"""
+    # Load the encoder in the background so the first search doesn't pay for it
+    if os.environ.get('LOCZ_WARMUP_MODEL', '1') == '1':
+        warm_up_model()
+
+    # Finish embedding runs the last shutdown interrupted
+    if os.environ.get('LOCZ_RESUME_EMBEDDINGS', '1') == '1':
+        resume_embeddings()
+
+@app.before_request
+def select_project():
+    """Point database access at the project this request is for"""
+    project = project_from_request(request)
+    if project is None:
+        return jsonify({'error': 'Unknown project'}), 404
+    use_project(project)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', project=current_project())
 
-@app.route('/api/similarity_status')
-def get_similarity_status():
-    # Get the most recent session (you could make this more sophisticated)
-    conn = sqlite3.connect('translations.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT session_id, total_strings, processed_strings, is_complete
-        FROM processing_status 
-        ORDER BY created_at DESC 
-        LIMIT 1
-    ''')
-    
-    result = cursor.fetchone()
-    
-    if not result:
-        return jsonify({'complete': False, 'processed': 0, 'total': 0, 'percentage': 0})
-    
-    session_id, total, processed, is_complete = result
-    percentage = int((processed / total) * 100) if total > 0 else 0
+@app.route('/api/projects', methods=['GET', 'POST'])
+def projects():
+    if request.method == 'GET':
+        return jsonify({'projects': list_projects(), 'current': current_project()})
 
-    cursor.execute('SELECT COUNT(*) FROM embeddings')
-    embeddings_count = cursor.fetchone()[0]
-    
-    conn.close()
+    data = request.get_json(silent=True) or {}
+    try:
+        name = prepare_project(data.get('name'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if project_exists(name):
+        return jsonify({'error': f'Project {name} already exists'}), 409
 
-    return jsonify({
-        'complete': bool(is_complete),
-        'embeddings_exist': embeddings_count > 0,
+    # Opening the shard creates it with the full schema
+    get_connection(name).close()
+    print(f"📁 Created project {name}")
+    return jsonify({'success': True, 'project': name})
+
+def similarity_payload(project, status):
+    """Status for the page, built from in-memory counters only"""
+    total = status.get('total') or 0
+    processed = status.get('processed') or 0
+    state = status.get('state')
+    payload = dict(status)
+    payload.update({
+        'complete': state == 'complete',
+        # Searches use whatever vectors exist, but only cover everything when complete
+        'partial': state != 'complete' and processed > 0,
+        'embeddings_exist': processed > 0,
         'total': total,
         'processed': processed,
-        'percentage': percentage,
-        'total_processed': embeddings_count
+        'percentage': int((processed / total) * 100) if total > 0 else 0,
+        'total_processed': processed,
+        'jobs': [job.to_dict() for job in job_scheduler.list_jobs(project) if job.state in ACTIVE_STATES]
     })
+    return payload
+
+@app.route('/api/similarity_status')
+def get_similarity_status():
+    project = current_project()
+    version, status = progress_board.get(project)
+    return jsonify(similarity_payload(project, status))
+
+@app.route('/api/progress/stream')
+def progress_stream():
+    """Server-Sent Events with the project's similarity status, sent whenever it changes.
+
+    ?session_id= only reports that upload session.
+    """
+    project = current_project()
+    session_id = request.args.get('session_id')
+
+    def events():
+        yield f'retry: {STREAM_KEEPALIVE * 1000}\n\n'
+        version = -1
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            changed = progress_board.wait(project, version, STREAM_KEEPALIVE)
+            if changed is None:
+                yield ': keep-alive\n\n'
+                continue
+            version, status = changed
+            if session_id and status.get('session_id') != session_id:
+                continue
+            payload = similarity_payload(project, status)
+            yield f'id: {version}\nevent: progress\ndata: {json.dumps(payload)}\n\n'
+            # Several batches finishing close together become one event
+            time.sleep(STREAM_MIN_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/model_status')
+def get_model_status():
+    stats = get_model_stats()
+    stats['index'] = get_embedding_index().memory_stats()
+    stats['similarity_cache'] = similarity_cache.stats()
+    return jsonify(stats)
+
+@app.route('/api/db_status')
+def get_db_status():
+    return jsonify(get_pool_stats())
+
+@app.route('/api/jobs')
+def list_jobs():
+    """Background jobs of the current project, newest first"""
+    jobs = sorted(job_scheduler.list_jobs(current_project()), key=lambda job: job.id, reverse=True)
+    return jsonify({'jobs': [job.to_dict() for job in jobs]})
+
+@app.route('/api/jobs/<int:job_id>')
+def get_job(job_id):
+    job = job_scheduler.get(job_id)
+    if job is None or job.project != current_project():
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_scheduler.get(job_id)
+    if job is None or job.project != current_project():
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_scheduler.cancel(job_id):
+        return jsonify({'error': f'Job already {job.state}'}), 409
+    return jsonify(job.to_dict())
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -266,56 +408,95 @@ def upload_file():
     try:
         # Create upload session ID
         session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Clear previous data
-        conn = sqlite3.connect('translations.db')
+        incremental = request.form.get('mode') == 'incremental'
+
+        # Stream the sheet instead of loading it whole (header is checked up front)
+        try:
+            chunks = read_excel_chunks(file.stream, file.filename)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        project = current_project()
+        superseded = job_scheduler.supersede(project, UPLOAD_JOB_KINDS)
+        # They stop at their next batch; don't race them for the write lock,
+        # but give up after SUPERSEDE_TIMEOUT in total, not per job
+        deadline = time.monotonic() + SUPERSEDE_TIMEOUT
+        for job in superseded:
+            job.wait(max(0, deadline - time.monotonic()))
+        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM translations')
-        cursor.execute('DELETE FROM similarity_cache')
-        conn.commit()
-        
-        # Read Excel file
-        df = pd.read_excel(file)
-        
-        # Expected columns: strID, EN, IT (adjust as needed)
-        # required_cols = ['strId', 'EN', 'IT']
-        print(df.columns)
-        # required_cols = ['strId', 'EN', 'German']
-        required_cols = ['字符串', "EN", 'Italian']
-        if not all(col in df.columns for col in required_cols):
-            return jsonify({'error': f'Excel must contain columns: {required_cols}'}), 400
-        
-        # Insert data into database
-        for _, row in df.iterrows():
-            cursor.execute('''
-                INSERT INTO translations (str_id, en_text, it_text, original_it_text, upload_session)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                str(row['字符串']),
-                str(row['EN']) if pd.notna(row['EN']) else '',
-                str(row['Italian']) if pd.notna(row['Italian']) else '',
-                str(row['Italian']) if pd.notna(row['Italian']) else '',
-                session_id
-            ))
-        
-        conn.commit()
-        total_rows = len(df)
-        
-        # Start background TF-IDF processing
-        compute_similarities(session_id)
-
-        # START BACKGROUND EMBEDDING PROCESSING FOR FASTER SIMILARITY SEARCH
-        thread = threading.Thread(target=process_embeddings_background, args=(session_id,))
-        thread.daemon = True
-        thread.start()
-        processing_threads[session_id] = thread
+
+        if incremental:
+            # Keep the current session so existing embeddings stay valid
+            cursor.execute('SELECT upload_session FROM translations ORDER BY id DESC LIMIT 1')
+            existing = cursor.fetchone()
+            incremental = existing is not None
+
+        if incremental:
+            session_id = existing[0]
+            merge = merge_translation_chunks(cursor, chunks, session_id)
+            cursor.execute('DELETE FROM embeddings WHERE str_id NOT IN (SELECT str_id FROM translations)')
+            cursor.execute('DELETE FROM similar_strings WHERE str_id NOT IN (SELECT str_id FROM translations)')
+            # Changed strings lose their vectors in the same commit, so a run cut
+            # short later still knows they need embedding
+            cursor.executemany('DELETE FROM embeddings WHERE str_id = ?', [(str_id,) for str_id in merge['delta_ids']])
+            conn.commit()
+            get_embedding_index(project).invalidate()
+
+            total_rows = merge['total']
+            delta_ids = merge['delta_ids']
+            message = (f"Merged {total_rows} translations: {merge['inserted']} new, "
+                       f"{merge['updated']} updated, {merge['retired']} retired")
+        else:
+            # Clear previous data and insert the new rows in a single transaction,
+            # re-indexing for search once at the end instead of row by row
+            suspend_search_index(cursor)
+            cursor.execute('DELETE FROM translations')
+            cursor.execute('DELETE FROM similar_strings')
+            cursor.execute('DELETE FROM embeddings')
+            cursor.execute('DELETE FROM vector_files')
+            total_rows = insert_translation_chunks(cursor, chunks, session_id)
+            resume_search_index(cursor)
+            conn.commit()
+            # The index still maps the old files, let go of them before deleting
+            get_embedding_index(project).invalidate()
+            remove_ann_index(ann_path(project))
+            sweep_vector_files(cursor, project)
+
+            delta_ids = None
+            message = f'Uploaded {total_rows} translations successfully'
+
+        similarity_cache.invalidate(project)
+        get_fuzzy_index(project).invalidate()
+
+        # A cancelled TF-IDF run may not have covered its own changes, so redo the
+        # whole session (the embedding run picks up every string without a vector)
+        if superseded and delta_ids is not None:
+            delta_ids = None
+
+        # Only recompute similarity data when something actually changed
+        job_ids = []
+        if delta_ids is None or delta_ids:
+            # TF-IDF neighbours are quick and feed /api/similar, so they go first
+            tfidf_job = job_scheduler.submit('similarities', compute_similarities, (session_id, delta_ids, project),
+                                             project=project, priority=PRIORITY_NORMAL, wait_for=superseded)
+            embedding_job = job_scheduler.submit('embeddings', process_embeddings_background, (session_id, project),
+                                                 project=project, priority=PRIORITY_BULK, wait_for=superseded)
+            job_ids = [tfidf_job.id, embedding_job.id]
+            # The new run starts from the vectors that are left: none after a full upload
+            cursor.execute('SELECT COUNT(*) FROM embeddings WHERE upload_session = ?', (session_id,))
+            kept = cursor.fetchone()[0]
+            progress_board.update(project, session_id=session_id, state='queued', error=None, total=total_rows,
+                                  processed=kept, cache_hits=0, cache_misses=0, strings_per_second=0)
         
         conn.close()
+        bump_data_version()
         
         return jsonify({
             'success': True, 
-            'message': f'Uploaded {total_rows} translations successfully',
-            'session_id': session_id
+            'message': message,
+            'session_id': session_id,
+            'job_ids': job_ids
         })
         
     except Exception as e:
@@ -328,15 +509,16 @@ def get_translations():
     search_value = request.args.get('search[value]', '')
     show_modified = request.args.get('show_modified', 'false') == 'true'
     get_total = request.args.get('get_total', 'false') == 'true'
+    after_id = request.args.get('after_id', type=int)
 
     similarity_search = request.args.get('similarity_search', '')
+    similarity_limit = min(request.args.get('similarity_limit', SIMILARITY_RESULTS, type=int), MAX_SIMILARITY_RESULTS)
     
-    conn = sqlite3.connect('translations.db')
+    conn = get_connection()
     cursor = conn.cursor()
 
     if get_total:
-        cursor.execute('SELECT COUNT(*) FROM translations')
-        total = cursor.fetchone()[0]
+        total = count_rows(cursor, "WHERE 1=1", [])
         conn.close()
         return jsonify({'recordsTotal': total})
     
@@ -344,226 +526,279 @@ def get_translations():
     where_clause = "WHERE 1=1"
     params = []
 
+    similarity_state = None
     if similarity_search:
-        # Get similar string IDs using your existing TF-IDF
-        similar_ids = get_similar_strings_fast(similarity_search)
-        if similar_ids:
-            placeholders = ','.join(['?' for _ in similar_ids])
-            where_clause += f" AND str_id IN ({placeholders})"
-            params.extend(similar_ids)
+        # Tell the client when the vectors don't cover every string yet
+        similarity_state = progress_board.get(current_project())[1].get('state')
     
     if search_value:
-        where_clause += " AND (str_id LIKE ? OR en_text LIKE ? OR it_text LIKE ?)"
-        search_param = f'%{search_value}%'
-        params.extend([search_param, search_param, search_param])
+        search_filter, search_params = search_clause(search_value)
+        where_clause += f" AND {search_filter}"
+        params.extend(search_params)
     
     if show_modified:
         where_clause += " AND is_modified = 1"
     
-    # Get total count
-    cursor.execute(f"SELECT COUNT(*) FROM translations {where_clause}", params)
-    total_records = cursor.fetchone()[0]
-    
-    # Get paginated data
-    query = f'''
-        SELECT id, str_id, en_text, it_text, is_modified 
-        FROM translations {where_clause}
-        ORDER BY id
-        LIMIT ? OFFSET ?
-    '''
-    params.extend([length, start])
-    cursor.execute(query, params)
-    
-    rows = cursor.fetchall()
+    if similarity_search:
+        # Best match first, paged by rank over the cached result list
+        try:
+            matches = search_similar(similarity_search, max_results=max(similarity_limit, 1))
+        except Exception as e:
+            print(f"❌ Fast similarity search error: {e}")
+            matches = []
+        total_records, rows = fetch_ranked_page(
+            cursor, 'id, str_id, en_text, it_text, is_modified',
+            matches, where_clause, params, start, length
+        )
+    else:
+        # Get total count and paginated data (keyset seek, counts cached per data version)
+        total_records, rows = fetch_page(
+            cursor, 'id, str_id, en_text, it_text, is_modified',
+            where_clause, params, start, length, after_id
+        )
     conn.close()
     
     # Format for DataTables
     data = []
     for row in rows:
-        data.append({
+        item = {
             'id': row[0],
             'str_id': row[1],
             'en_text': row[2],
             'it_text': row[3],
             'is_modified': row[4]
-        })
+        }
+        if similarity_search:
+            item['score'] = round(row[5], 4)
+            item['match_type'] = row[6]
+        data.append(item)
     
     return jsonify({
         'draw': int(request.args.get('draw', 1)),
         'recordsTotal': total_records,
         'recordsFiltered': total_records,
-        'data': data
+        'data': data,
+        'next_start': start + len(data),
+        # Ranked pages are in score order, so there's no id to seek past
+        'next_after_id': data[-1]['id'] if data and not similarity_search else None,
+        'similarity_state': similarity_state
     })
 
 @app.route('/api/update_translation', methods=['POST'])
 def update_translation():
     data = request.get_json()
-    translation_id = data.get('id')
-    new_text = data.get('it_text', '')
-    
-    conn = sqlite3.connect('translations.db')
+    try:
+        [(translation_id, new_text)] = parse_updates([data])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    is_modified = update_translation_text(translation_id, new_text)
+    if is_modified is None:
+        return jsonify({'error': 'Translation not found'}), 404
+
+    return jsonify({'success': True, 'is_modified': is_modified})
+
+@app.route('/api/update_translations', methods=['POST'])
+def update_translations():
+    """Save many edits at once: {"updates": [{"id": ..., "it_text": ...}, ...]}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        updates = parse_updates(data.get('updates'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_connection()
     cursor = conn.cursor()
+    results = apply_translation_updates(cursor, updates)
+    conn.commit()
+    conn.close()
+
+    if results:
+        bump_data_version()
+
+    not_found = sorted({translation_id for translation_id, _ in updates} - results.keys())
+    print(f"✏️ Bulk edit: {len(results)} rows saved, {len(not_found)} not found")
+
+    return jsonify({
+        'success': True,
+        'updated': len(results),
+        'modified': sum(1 for is_modified in results.values() if is_modified),
+        'results': [{'id': translation_id, 'is_modified': is_modified}
+                    for translation_id, is_modified in results.items()],
+        'not_found': not_found
+    })
+
+@app.route('/api/fuzzy_matches')
+def get_fuzzy_matches():
+    """Translation memory: Italian translations of EN strings close to ?text= or to ?str_id='s EN"""
+    text = request.args.get('text', '')
+    str_id = request.args.get('str_id')
+    
+    if str_id:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT en_text FROM translations WHERE str_id = ?', (str_id,))
+        result = cursor.fetchone()
+        conn.close()
+        if not result:
+            return jsonify({'error': 'String not found'}), 404
+        text = result[0] or ''
     
-    # Get original text to check if it's actually modified
-    cursor.execute('SELECT original_it_text FROM translations WHERE id = ?', (translation_id,))
-    original = cursor.fetchone()
+    if not text.strip():
+        return jsonify({'error': 'No text to match'}), 400
     
-    if original:
-        is_modified = 1 if new_text != original[0] else 0
-        print(f"New text: '{new_text}'")
-        print(f"Original text: '{original[0]}'")
-        print(f"Are they different? {new_text != original[0]}")
-        print(f"is_modified: {is_modified}")
-        
-        cursor.execute('''
-            UPDATE translations 
-            SET it_text = ?, is_modified = ?
-            WHERE id = ?
-        ''', (new_text, is_modified, translation_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'is_modified': is_modified})
+    try:
+        result = find_fuzzy_matches(text, request.args.get('min_score', type=float),
+                                    request.args.get('limit', type=int), exclude_str_id=str_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    conn.close()
-    return jsonify({'error': 'Translation not found'}), 404
+    result['query'] = text
+    return jsonify(result)
 
 @app.route('/api/similar/<str_id>')
 def get_similar(str_id):
-    conn = sqlite3.connect('translations.db')
+    if request.args.get('mode') == 'semantic':
+        return jsonify(get_semantic_neighbours(str_id))
+
+    conn = get_connection()
     cursor = conn.cursor()
     
-    # Get cached similarities
-    cursor.execute('SELECT similar_ids FROM similarity_cache WHERE str_id = ?', (str_id,))
-    result = cursor.fetchone()
-    
-    if result:
-        similar_ids = json.loads(result[0])
-        
-        # Get the actual translations
-        if similar_ids:
-            placeholders = ','.join(['?' for _ in similar_ids])
-            cursor.execute(f'''
-                SELECT str_id, en_text, it_text 
-                FROM translations 
-                WHERE str_id IN ({placeholders})
-                LIMIT 10
-            ''', similar_ids)
-            
-            similar_translations = cursor.fetchall()
-            conn.close()
-            
-            return jsonify([{
-                'str_id': row[0],
-                'en_text': row[1],
-                'it_text': row[2]
-            } for row in similar_translations])
-    
+    # Cached neighbours in rank order, joined to their current text
+    cursor.execute('''
+        SELECT s.neighbour_str_id, t.en_text, t.it_text, s.score
+        FROM similar_strings s
+        JOIN translations t ON t.str_id = s.neighbour_str_id
+        WHERE s.str_id = ?
+        ORDER BY s.rank
+        LIMIT 10
+    ''', (str_id,))
+    
+    similar_translations = cursor.fetchall()
     conn.close()
-    return jsonify([])
+    
+    return jsonify([{
+        'str_id': row[0],
+        'en_text': row[1],
+        'it_text': row[2],
+        'score': round(row[3], 4)
+    } for row in similar_translations])
 
 @app.route('/api/export')
 def export_modified():
-    conn = sqlite3.connect('translations.db')
-    
-    # Get only modified translations
-    df = pd.read_sql_query('''
-        SELECT '' as SOURCE, str_id as 字符串, en_text as EN, it_text as Italian
-        FROM translations 
-        WHERE is_modified = 1
-        ORDER BY str_id
-    ''', conn)
-    
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+
+    conn = get_connection()
+    has_rows = has_modified_rows(conn.cursor())
     conn.close()
     
-    if df.empty:
+    if not has_rows:
         return jsonify({'error': 'No modified translations to export'}), 400
     
-    # Create temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    df.to_excel(temp_file.name, index=False)
-    temp_file.close()
-    
-    return send_file(
-        temp_file.name,
-        as_attachment=True,
-        download_name=f'modified_translations_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    # Rows go from the cursor to the client chunk by chunk
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f'modified_translations_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    return Response(
+        iter_export(export_format, current_project()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
-def get_similar_strings_fast(search_text, threshold=0.4, max_results=300):
-    """Fast similarity search using pre-computed embeddings"""
+def search_similar(search_text, threshold=0.4, max_results=300):
+    """Ranked [(str_id, score, match_type)] from the resident embedding index.
+
+    Results are cached per index version, so DataTables paging and redraws
+    of the same search don't encode and score again.
+    """
+    conn = get_connection()
+    
+    # Pull any embeddings added since the last search; while a run is
+    # unfinished or failed this covers only the strings embedded so far
+    embedding_index = get_embedding_index()
+    embedding_index.refresh(conn)
+    conn.close()
+    if len(embedding_index) == 0:
+        return []
+    
+    cache_key = (current_project(), search_text, threshold, max_results, embedding_index.version)
+    matches = similarity_cache.get(cache_key)
+    if matches is not None:
+        return matches
+    
+    # Someone is waiting on this - background embedding pauses until it's done
+    with job_scheduler.interactive():
+        # Encode the query with the resident model
+        search_embeddings = encode_texts([search_text])
+        if search_embeddings is None:
+            return []
+        
+        matches = embedding_index.search(search_embeddings[0], search_text, threshold, max_results)
+    similarity_cache.put(cache_key, matches)
+    print(f"✅ Found {len(matches)} matches using fast cached search")
+    return matches
+
+def get_semantic_neighbours(str_id, max_results=10, threshold=0.4):
+    """Nearest strings to str_id by embedding, via the ANN index when it's ready"""
     try:
-        conn = sqlite3.connect('translations.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        # Check if embeddings are ready
-        cursor.execute('SELECT COUNT(*) FROM processing_status WHERE is_complete = 1')
-        if cursor.fetchone()[0] == 0:
+        cursor.execute('SELECT vector_row FROM embeddings WHERE str_id = ? LIMIT 1', (str_id,))
+        result = cursor.fetchone()
+        if not result:
             conn.close()
             return []
         
-        # Get all embeddings
-        cursor.execute('''
-            SELECT e.str_id, e.embedding, t.en_text, t.it_text
-            FROM embeddings e
-            JOIN translations t ON e.str_id = t.str_id
-        ''')
-        
-        rows = cursor.fetchall()
-        if not rows:
+        embedding_index = get_embedding_index()
+        embedding_index.refresh(conn)
+        vector = embedding_index.vector(result[0])
+        if vector is None:
             conn.close()
             return []
+        with job_scheduler.interactive():
+            matches = embedding_index.search(vector, '', threshold, max_results + 1)
+        similar_ids = [match_id for match_id, score, match_type in matches if match_id != str_id][:max_results]
+        scores = {match_id: score for match_id, score, match_type in matches}
         
-        # Load the model for search embedding
-        from sentence_transformers import SentenceTransformer
-        import numpy as np
-        
-        model = SentenceTransformer('all-MiniLM-L6-v2')
-        search_embedding = model.encode([search_text], show_progress_bar=False)[0]
-        
-        matches = {}
-        search_lower = search_text.lower()
-        
-        for str_id, embedding_blob, en_text, it_text in rows:
-            # combined_text = f"{en_text or ''} {it_text or ''}".strip()
-            combined_text = (en_text or '').strip()
-            text_lower = combined_text.lower()
-            
-            # 1. Exact/substring matching (highest priority)
-            if search_lower == text_lower:
-                matches[str_id] = (1.0, "exact")
-                continue
-            elif search_lower in text_lower:
-                score = 0.95 + (len(search_text) / len(combined_text)) * 0.04
-                matches[str_id] = (score, "contains")
-                continue
-            
-            # 2. Semantic similarity using cached embeddings
-            stored_embedding = np.frombuffer(embedding_blob, dtype=np.float32)
-            similarity = np.dot(search_embedding, stored_embedding)
+        neighbours = []
+        if similar_ids:
+            placeholders = ','.join(['?' for _ in similar_ids])
+            cursor.execute(f'''
+                SELECT str_id, en_text, it_text 
+                FROM translations 
+                WHERE str_id IN ({placeholders})
+            ''', similar_ids)
+            found = {row[0]: row for row in cursor.fetchall()}
             
-            if similarity > threshold:
-                score = 0.20 + similarity * 0.69
-                matches[str_id] = (score, f"semantic_{similarity:.2f}")
-        
-        # Sort by score and return
-        sorted_matches = sorted(matches.items(), key=lambda x: x[1][0], reverse=True)
-        result_ids = [str_id for str_id, (score, match_type) in sorted_matches[:max_results]]
+            # Keep the ranking from the search
+            for similar_id in similar_ids:
+                if similar_id in found:
+                    row = found[similar_id]
+                    neighbours.append({
+                        'str_id': row[0],
+                        'en_text': row[1],
+                        'it_text': row[2],
+                        'score': round(scores[similar_id], 4)
+                    })
         
-        print(f"✅ Found {len(result_ids)} matches using fast cached search")
         conn.close()
-        return result_ids
+        return neighbours
         
     except Exception as e:
-        print(f"❌ Fast similarity search error: {e}")
-        return []        
+        print(f"❌ Semantic neighbour search error: {e}")
+        return []
 
-def compute_similarities(session_id):
-    """Background task to compute TF-IDF similarities"""
+def compute_similarities(session_id, str_ids=None, project=DEFAULT_PROJECT, job=None):
+    """Background task to compute TF-IDF similarities.
+
+    The vocabulary is always fitted on the whole session, but when str_ids is
+    given only the neighbours of those strings are recomputed.
+    """
+    use_project(project)
     try:
-        conn = sqlite3.connect('translations.db')
+        conn = get_connection()
         
         # Get all English texts
         df = pd.read_sql_query('''
@@ -579,29 +814,56 @@ def compute_similarities(session_id):
         # Compute TF-IDF
         vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
         tfidf_matrix = vectorizer.fit_transform(df['en_text'].fillna(''))
-        
-        # Compute similarities
-        similarity_matrix = cosine_similarity(tfidf_matrix)
-        
+
         cursor = conn.cursor()
+        all_str_ids = df['str_id'].to_numpy()
+
+        if str_ids is None:
+            positions = None
+            # Other sessions' rows can only be leftovers of a superseded run
+            cursor.execute('DELETE FROM similar_strings WHERE upload_session != ?', (session_id,))
+        else:
+            wanted = set(str_ids)
+            positions = [i for i, str_id in enumerate(all_str_ids) if str_id in wanted]
+            cursor.executemany('DELETE FROM similar_strings WHERE str_id = ?', [(str_id,) for str_id in wanted])
+        conn.commit()
         
-        # Store top 5 similar strings for each string
-        for i, str_id in enumerate(df['str_id']):
-            similarities = similarity_matrix[i]
-            # Get indices of most similar (excluding self)
-            similar_indices = np.argsort(similarities)[::-1][1:6]  # Top 5, excluding self
-            similar_str_ids = [df.iloc[j]['str_id'] for j in similar_indices if similarities[j] > 0.3]
+        # Store top 5 similar strings for each string, chunk by chunk
+        stored = 0
+        if job:
+            job.set_progress(0, len(all_str_ids) if positions is None else len(positions))
+        for rows, neighbours, scores in iter_tfidf_neighbours(tfidf_matrix, positions):
+            if job:
+                job.checkpoint()
+            records = []
+            for i, row_neighbours, row_scores in zip(rows, neighbours, scores):
+                kept = [(j, score) for j, score in zip(row_neighbours, row_scores) if score > MIN_SCORE]
+                for rank, (j, score) in enumerate(kept):
+                    records.append((all_str_ids[i], rank, all_str_ids[j], float(score), session_id))
             
-            cursor.execute('''
-                INSERT INTO similarity_cache (str_id, similar_ids, upload_session)
-                VALUES (?, ?, ?)
-            ''', (str_id, json.dumps(similar_str_ids), session_id))
+            cursor.executemany('''
+                INSERT OR REPLACE INTO similar_strings (str_id, rank, neighbour_str_id, score, upload_session)
+                VALUES (?, ?, ?, ?, ?)
+            ''', records)
+            # Commit per chunk so the embedding job isn't locked out for the whole run
+            conn.commit()
+            stored += len(rows)
+            if job:
+                job.set_progress(stored)
         
-        conn.commit()
+        print(f"✅ Stored TF-IDF neighbours for {stored} strings")
         conn.close()
         
+    except JobCancelled:
+        print(f"🛑 TF-IDF processing cancelled for session {session_id}")
+        conn.close()
+        raise
     except Exception as e:
         print(f"Error computing similarities: {e}")
+        raise
 
 if __name__ == '__main__':
+    # The reloader imports this file in a watcher process too; only the server runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_work()
     app.run(debug=True, port=5000)
@@ -1,17 +1,24 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import sqlite3
-import pandas as pd
-import tempfile
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from db import get_connection, get_pool_stats, register_schema
+from projects import (DEFAULT_PROJECT, current_project, use_project, project_from_request,
+                      project_exists, list_projects, prepare_project)
+import json
 from datetime import datetime
+from ingest import read_excel_chunks, insert_translation_chunks, merge_translation_chunks
+from search_index import init_search_index, search_clause, suspend_search_index, resume_search_index
+from listing import bump_data_version, count_rows, fetch_page
+from replace_engine import apply_replace_all, iter_replace_preview
+from edit_journal import (init_edit_journal, clear_edit_journal, record_operation,
+                          undo_operation, redo_operation, list_operations, JournalError)
+from export import EXPORT_FORMATS, has_modified_rows, iter_export
+from bulk_edit import parse_updates, apply_translation_updates, update_translation_text
+from fuzzy_match import find_fuzzy_matches, get_fuzzy_index
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 1000 * 1024 * 1024  # 1000GB max file size
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect('translations.db')
-    cursor = conn.cursor()
-    
+# Database setup, run on every project shard the first time it is opened
+def init_db(cursor):
     # Main translations table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS translations (
@@ -25,6 +32,13 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_translations_str_id ON translations(str_id)')
+
+    # Full-text index for the table search box
+    init_search_index(cursor)
+
+    # Undo/redo journal for replace all
+    init_edit_journal(cursor)
     
     # Similarity cache table (keeping for compatibility)
     cursor.execute('''
@@ -35,21 +49,46 @@ def init_db():
             upload_session TEXT
         )
     ''')
-    
-    conn.commit()
-    conn.close()
 
-# Initialize database on startup
-init_db()
+register_schema(init_db)
+
+# Initialize the default project's database on startup
+get_connection(DEFAULT_PROJECT).close()
+
+@app.before_request
+def select_project():
+    """Point database access at the project this request is for"""
+    project = project_from_request(request)
+    if project is None:
+        return jsonify({'error': 'Unknown project'}), 404
+    use_project(project)
 
 @app.route('/')
 def index():
-    return render_template('index_lightweight.html')
+    return render_template('index_lightweight.html', project=current_project())
+
+@app.route('/api/projects', methods=['GET', 'POST'])
+def projects():
+    if request.method == 'GET':
+        return jsonify({'projects': list_projects(), 'current': current_project()})
+
+    data = request.get_json(silent=True) or {}
+    try:
+        name = prepare_project(data.get('name'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if project_exists(name):
+        return jsonify({'error': f'Project {name} already exists'}), 409
+
+    # Opening the shard creates it with the full schema
+    get_connection(name).close()
+    print(f"📁 Created project {name}")
+    return jsonify({'success': True, 'project': name})
 
 @app.route('/api/similarity_status')
 def get_similarity_status():
     # Always return ready since we don't need preprocessing
-    conn = sqlite3.connect('translations.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT COUNT(*) FROM translations')
@@ -66,6 +105,38 @@ def get_similarity_status():
         'total_processed': total_count
     })
 
+@app.route('/api/db_status')
+def get_db_status():
+    return jsonify(get_pool_stats())
+
+@app.route('/api/fuzzy_matches')
+def get_fuzzy_matches():
+    """Translation memory: Italian translations of EN strings close to ?text= or to ?str_id='s EN"""
+    text = request.args.get('text', '')
+    str_id = request.args.get('str_id')
+    
+    if str_id:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT en_text FROM translations WHERE str_id = ?', (str_id,))
+        result = cursor.fetchone()
+        conn.close()
+        if not result:
+            return jsonify({'error': 'String not found'}), 404
+        text = result[0] or ''
+    
+    if not text.strip():
+        return jsonify({'error': 'No text to match'}), 400
+    
+    try:
+        result = find_fuzzy_matches(text, request.args.get('min_score', type=float),
+                                    request.args.get('limit', type=int), exclude_str_id=str_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    result['query'] = text
+    return jsonify(result)
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -81,44 +152,53 @@ def upload_file():
     try:
         # Create upload session ID
         session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Clear previous data
-        conn = sqlite3.connect('translations.db')
+        incremental = request.form.get('mode') == 'incremental'
+
+        # Stream the sheet instead of loading it whole (header is checked up front)
+        try:
+            chunks = read_excel_chunks(file.stream, file.filename)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM translations')
-        cursor.execute('DELETE FROM similarity_cache')
-        conn.commit()
-        
-        # Read Excel file
-        df = pd.read_excel(file)
-        
-        # Expected columns
-        print(df.columns)
-        required_cols = ['字符串', "EN", 'Italian']
-        if not all(col in df.columns for col in required_cols):
-            return jsonify({'error': f'Excel must contain columns: {required_cols}'}), 400
-        
-        # Insert data into database
-        for _, row in df.iterrows():
-            cursor.execute('''
-                INSERT INTO translations (str_id, en_text, it_text, original_it_text, upload_session)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                str(row['字符串']),
-                str(row['EN']) if pd.notna(row['EN']) else '',
-                str(row['Italian']) if pd.notna(row['Italian']) else '',
-                str(row['Italian']) if pd.notna(row['Italian']) else '',
-                session_id
-            ))
-        
-        conn.commit()
-        total_rows = len(df)
+
+        if incremental:
+            # Keep the current session id when merging into existing data
+            cursor.execute('SELECT upload_session FROM translations ORDER BY id DESC LIMIT 1')
+            existing = cursor.fetchone()
+            incremental = existing is not None
+
+        if incremental:
+            session_id = existing[0]
+            merge = merge_translation_chunks(cursor, chunks, session_id)
+            cursor.execute('DELETE FROM similarity_cache WHERE str_id NOT IN (SELECT str_id FROM translations)')
+            clear_edit_journal(cursor)
+            conn.commit()
+
+            total_rows = merge['total']
+            message = (f"Merged {total_rows} translations: {merge['inserted']} new, "
+                       f"{merge['updated']} updated, {merge['retired']} retired")
+        else:
+            # Clear previous data and insert the new rows in a single transaction,
+            # re-indexing for search once at the end instead of row by row
+            suspend_search_index(cursor)
+            cursor.execute('DELETE FROM translations')
+            cursor.execute('DELETE FROM similarity_cache')
+            clear_edit_journal(cursor)
+            total_rows = insert_translation_chunks(cursor, chunks, session_id)
+            resume_search_index(cursor)
+            conn.commit()
+
+            message = f'Uploaded {total_rows} translations successfully'
         
         conn.close()
+        bump_data_version()
+        get_fuzzy_index().invalidate()
         
         return jsonify({
             'success': True, 
-            'message': f'Uploaded {total_rows} translations successfully',
+            'message': message,
             'session_id': session_id
         })
         
@@ -132,43 +212,34 @@ def get_translations():
     search_value = request.args.get('search[value]', '')
     show_modified = request.args.get('show_modified', 'false') == 'true'
     get_total = request.args.get('get_total', 'false') == 'true'
+    after_id = request.args.get('after_id', type=int)
 
-    conn = sqlite3.connect('translations.db')
+    conn = get_connection()
     cursor = conn.cursor()
 
     if get_total:
-        cursor.execute('SELECT COUNT(*) FROM translations')
-        total = cursor.fetchone()[0]
+        total = count_rows(cursor, "WHERE 1=1", [])
+        modified = count_rows(cursor, "WHERE 1=1 AND is_modified = 1", [])
         conn.close()
-        return jsonify({'recordsTotal': total})
+        return jsonify({'recordsTotal': total, 'modifiedTotal': modified})
     
     # Base query
     where_clause = "WHERE 1=1"
     params = []
     
     if search_value:
-        where_clause += " AND (str_id LIKE ? OR en_text LIKE ? OR it_text LIKE ?)"
-        search_param = f'%{search_value}%'
-        params.extend([search_param, search_param, search_param])
+        search_filter, search_params = search_clause(search_value)
+        where_clause += f" AND {search_filter}"
+        params.extend(search_params)
     
     if show_modified:
         where_clause += " AND is_modified = 1"
     
-    # Get total count
-    cursor.execute(f"SELECT COUNT(*) FROM translations {where_clause}", params)
-    total_records = cursor.fetchone()[0]
-    
-    # Get paginated data
-    query = f'''
-        SELECT id, str_id, en_text, it_text, is_modified 
-        FROM translations {where_clause}
-        ORDER BY id
-        LIMIT ? OFFSET ?
-    '''
-    params.extend([length, start])
-    cursor.execute(query, params)
-    
-    rows = cursor.fetchall()
+    # Get total count and paginated data (keyset seek, counts cached per data version)
+    total_records, rows = fetch_page(
+        cursor, 'id, str_id, en_text, it_text, is_modified',
+        where_clause, params, start, length, after_id
+    )
     conn.close()
     
     # Format for DataTables
@@ -186,70 +257,75 @@ def get_translations():
         'draw': int(request.args.get('draw', 1)),
         'recordsTotal': total_records,
         'recordsFiltered': total_records,
-        'data': data
+        'data': data,
+        'next_start': start + len(data),
+        'next_after_id': data[-1]['id'] if data else None
     })
 
 @app.route('/api/update_translation', methods=['POST'])
 def update_translation():
     data = request.get_json()
-    translation_id = data.get('id')
-    new_text = data.get('it_text', '')
-    
-    conn = sqlite3.connect('translations.db')
+    try:
+        [(translation_id, new_text)] = parse_updates([data])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    is_modified = update_translation_text(translation_id, new_text)
+    if is_modified is None:
+        return jsonify({'error': 'Translation not found'}), 404
+
+    return jsonify({'success': True, 'is_modified': is_modified})
+
+@app.route('/api/update_translations', methods=['POST'])
+def update_translations():
+    """Save many edits at once: {"updates": [{"id": ..., "it_text": ...}, ...]}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        updates = parse_updates(data.get('updates'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_connection()
     cursor = conn.cursor()
-    
-    # Get original text to check if it's actually modified
-    cursor.execute('SELECT original_it_text FROM translations WHERE id = ?', (translation_id,))
-    original = cursor.fetchone()
-    
-    if original:
-        is_modified = 1 if new_text != original[0] else 0
-        print(f"New text: '{new_text}'")
-        print(f"Original text: '{original[0]}'")
-        print(f"Are they different? {new_text != original[0]}")
-        print(f"is_modified: {is_modified}")
-        
-        cursor.execute('''
-            UPDATE translations 
-            SET it_text = ?, is_modified = ?
-            WHERE id = ?
-        ''', (new_text, is_modified, translation_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'is_modified': is_modified})
-    
+    results = apply_translation_updates(cursor, updates)
+    conn.commit()
     conn.close()
-    return jsonify({'error': 'Translation not found'}), 404
+
+    if results:
+        bump_data_version()
+
+    not_found = sorted({translation_id for translation_id, _ in updates} - results.keys())
+    print(f"✏️ Bulk edit: {len(results)} rows saved, {len(not_found)} not found")
+
+    return jsonify({
+        'success': True,
+        'updated': len(results),
+        'modified': sum(1 for is_modified in results.values() if is_modified),
+        'results': [{'id': translation_id, 'is_modified': is_modified}
+                    for translation_id, is_modified in results.items()],
+        'not_found': not_found
+    })
 
 @app.route('/api/export')
 def export_modified():
-    conn = sqlite3.connect('translations.db')
-    
-    # Get only modified translations
-    df = pd.read_sql_query('''
-        SELECT '' as SOURCE, str_id as 字符串, en_text as EN, it_text as Italian
-        FROM translations 
-        WHERE is_modified = 1
-        ORDER BY str_id
-    ''', conn)
-    
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+
+    conn = get_connection()
+    has_rows = has_modified_rows(conn.cursor())
     conn.close()
     
-    if df.empty:
+    if not has_rows:
         return jsonify({'error': 'No modified translations to export'}), 400
     
-    # Create temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    df.to_excel(temp_file.name, index=False)
-    temp_file.close()
-    
-    return send_file(
-        temp_file.name,
-        as_attachment=True,
-        download_name=f'modified_translations_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    # Rows go from the cursor to the client chunk by chunk
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f'modified_translations_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    return Response(
+        iter_export(export_format, current_project()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 @app.route('/api/replace_all', methods=['POST'])
@@ -262,100 +338,89 @@ def replace_all():
     
     if not search_text:
         return jsonify({'error': 'Search text cannot be empty'}), 400
+
+    if data.get('dry_run', False):
+        return preview_replace_all(search_text, replace_text, case_sensitive, whole_word)
     
-    conn = sqlite3.connect('translations.db')
+    conn = get_connection()
     cursor = conn.cursor()
-    
-    # Get all Italian texts
-    cursor.execute('SELECT id, it_text, original_it_text FROM translations')
-    rows = cursor.fetchall()
-    
-    updated_count = 0
-    updated_ids = []
 
     store_undo = data.get('store_undo', False)
-    undo_data = [] if store_undo else None
-    
-    for row_id, current_text, original_text in rows:
-        if not current_text:
-            continue
-            
-        # Perform replacement based on options
-        if case_sensitive:
-            if whole_word:
-                import re
-                pattern = r'\b' + re.escape(search_text) + r'\b'
-                new_text = re.sub(pattern, replace_text, current_text)
-            else:
-                new_text = current_text.replace(search_text, replace_text)
-        else:
-            if whole_word:
-                import re
-                pattern = r'\b' + re.escape(search_text) + r'\b'
-                new_text = re.sub(pattern, replace_text, current_text, flags=re.IGNORECASE)
-            else:
-                new_text = current_text.replace(search_text.lower(), replace_text)
-                new_text = current_text.replace(search_text.upper(), replace_text)
-                # Simple case-insensitive replace
-                import re
-                new_text = re.sub(re.escape(search_text), replace_text, current_text, flags=re.IGNORECASE)
-        
-        if new_text != current_text:
-            if store_undo:
-                undo_data.append({
-                                     'id': row_id,
-                                     'old_text': current_text,
-                                     'old_is_modified': 1 if current_text != original_text else 0
-                                 })
-            is_modified = 1 if new_text != original_text else 0
-            cursor.execute('UPDATE translations SET it_text = ?, is_modified = ? WHERE id = ?', 
-                         (new_text, is_modified, row_id))
-            updated_count += 1
-            updated_ids.append({'id': row_id, 'new_text': new_text, 'is_modified': is_modified})
+    updated_rows, before_images = apply_replace_all(
+        cursor, search_text, replace_text, case_sensitive, whole_word, store_undo
+    )
+
+    # Before-images stay on the server, the client only gets the operation id
+    op_id = None
+    if store_undo and updated_rows:
+        op_id = record_operation(cursor, f'Replace "{search_text}" with "{replace_text}"', before_images)
     
     conn.commit()
     conn.close()
+    if updated_rows:
+        bump_data_version()
+    print(f"🔁 Replaced '{search_text}' in {len(updated_rows)} rows")
     
+    # Only counts go back; the client reloads the table to see the new texts
     return jsonify({
                    'success': True,
-                   'updated_count': updated_count,
-                   'updated_rows': updated_ids,
-                   'undo_data': undo_data
+                   'updated_count': len(updated_rows),
+                   'op_id': op_id
            })
+
+def preview_replace_all(search_text, replace_text, case_sensitive, whole_word):
+    """Stream match counts and sample diffs as JSON lines without writing anything"""
+    project = current_project()
+
+    def generate():
+        conn = get_connection(project)
+        try:
+            for event in iter_replace_preview(conn.cursor(), search_text, replace_text, case_sensitive, whole_word):
+                yield json.dumps(event, ensure_ascii=False) + '\n'
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
     
 @app.route('/api/undo_replace', methods=['POST'])
 def undo_replace():
     data = request.get_json()
-    undo_data = data.get('undo_data', [])
-    store_redo = data.get('store_redo', False)
-    
-    conn = sqlite3.connect('translations.db')
+    return apply_journal(undo_operation, data.get('op_id'))
+
+@app.route('/api/redo_replace', methods=['POST'])
+def redo_replace():
+    data = request.get_json()
+    return apply_journal(redo_operation, data.get('op_id'))
+
+def apply_journal(operation, op_id):
+    """Run an undo or redo in one transaction"""
+    if not isinstance(op_id, int):
+        return jsonify({'error': 'op_id is required'}), 400
+
+    conn = get_connection()
     cursor = conn.cursor()
-    
-    redo_data = []
-    
-    for item in undo_data:
-        if store_redo:
-            # Get current state for redo
-            cursor.execute('SELECT it_text, is_modified FROM translations WHERE id = ?', (item['id'],))
-            current = cursor.fetchone()
-            if current:
-                redo_data.append({
-                    'id': item['id'],
-                    'old_text': current[0],
-                    'old_is_modified': current[1]
-                })
-        
-        cursor.execute('UPDATE translations SET it_text = ?, is_modified = ? WHERE id = ?',
-                      (item['old_text'], item['old_is_modified'], item['id']))
-    
+    try:
+        updated_rows = operation(cursor, op_id)
+    except JournalError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 409
+
     conn.commit()
     conn.close()
+    bump_data_version()
     
     return jsonify({
         'success': True,
-        'redo_data': redo_data if store_redo else None
+        'op_id': op_id,
+        'updated_count': len(updated_rows)
     })
 
+@app.route('/api/edit_history')
+def edit_history():
+    conn = get_connection()
+    operations = list_operations(conn.cursor())
+    conn.close()
+    return jsonify(operations)
+
 if __name__ == '__main__':
     app.run(debug=False, port=5000)
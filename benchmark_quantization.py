@@ -0,0 +1,105 @@
+import sys
+import time
+import numpy as np
+from db import get_connection
+from embedding_index import EmbeddingIndex
+from embedding_model import encode_texts
+from projects import DEFAULT_PROJECT, project_exists
+from vector_store import QUANTIZATIONS
+
+MAX_RESULTS = 300
+THRESHOLD = 0.4
+
+
+def sample_queries(project, count):
+    """Random EN texts of embedded strings with their file rows"""
+    conn = get_connection(project)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT t.en_text, e.vector_row
+        FROM embeddings e
+        JOIN translations t ON t.str_id = e.str_id
+        WHERE t.en_text IS NOT NULL AND t.en_text != ''
+        ORDER BY RANDOM()
+        LIMIT ?
+    ''', (count,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def load_index(project, quantization):
+    index = EmbeddingIndex(project, quantization)
+    conn = get_connection(project)
+    start = time.perf_counter()
+    index.refresh(conn)
+    conn.close()
+    return index, time.perf_counter() - start
+
+
+def run_queries(index, queries, rescore=True):
+    start = time.perf_counter()
+    results = [[str_id for str_id, _, _ in index.search(vector, text, THRESHOLD, MAX_RESULTS, rescore=rescore)]
+               for text, vector in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def compare(results, baseline):
+    """(recall of the float32 result ids, share of queries ranked identically)"""
+    recalls = [len(set(got) & set(expected)) / len(expected) if expected else float(not got)
+               for got, expected in zip(results, baseline)]
+    identical = sum(got == expected for got, expected in zip(results, baseline))
+    return float(np.mean(recalls)), identical / len(baseline)
+
+
+def main():
+    """Memory and recall of float16/int8 search against the float32 results.
+
+    float32 is exactly what search_similar (EmbeddingIndex.search) ranks with,
+    so it is the reference. Usage: python benchmark_quantization.py [project] [queries]
+    """
+    project = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PROJECT
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    if not project_exists(project):
+        print(f"❌ No project named {project}")
+        return
+
+    baseline_index, load_seconds = load_index(project, 'float32')
+    if len(baseline_index) == 0:
+        print(f"❌ Project {project} has no embeddings yet")
+        return
+
+    sampled = sample_queries(project, count)
+    texts = [text for text, _ in sampled]
+    vectors = encode_texts(texts)
+    if vectors is None:
+        print("⚠️ Embedding model not available, querying with the stored vectors")
+        vectors = [baseline_index.vector(row) for _, row in sampled]
+    queries = list(zip(texts, vectors))
+
+    baseline, baseline_ms = run_queries(baseline_index, queries)
+    stats = baseline_index.memory_stats()
+    float32_bytes = stats['float32_bytes']
+    del baseline_index
+
+    print(f"\n📏 {stats['vectors']} vectors, {len(queries)} queries, top {MAX_RESULTS} above {THRESHOLD}")
+    print(f"{'mode':<18}{'search MB':>10}{'vs f32':>8}{'load s':>8}{'ms/query':>10}{'recall':>8}{'same rank':>11}")
+    print(f"{'float32':<18}{float32_bytes / 2**20:>10.1f}{1:>8.2f}{load_seconds:>8.2f}{baseline_ms:>10.1f}"
+          f"{1:>8.3f}{1:>11.3f}")
+
+    for quantization in QUANTIZATIONS:
+        if quantization == 'float32':
+            continue
+        index, load_seconds = load_index(project, quantization)
+        search_bytes = index.memory_stats()['search_bytes']
+        for rescore in (False, True):
+            results, ms = run_queries(index, queries, rescore)
+            recall, identical = compare(results, baseline)
+            mode = f"{quantization}{' + rescore' if rescore else ''}"
+            print(f"{mode:<18}{search_bytes / 2**20:>10.1f}{search_bytes / float32_bytes:>8.2f}"
+                  f"{load_seconds:>8.2f}{ms:>10.1f}{recall:>8.3f}{identical:>11.3f}")
+        del index
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from db import get_connection
+from listing import bump_data_version
+from projects import current_project
+
+# Group single-cell edits arriving within this window into one commit
+COALESCE_WRITES = os.environ.get('LOCZ_COALESCE_WRITES', '0') == '1'
+COALESCE_WINDOW = float(os.environ.get('LOCZ_COALESCE_WINDOW_MS', 25)) / 1000
+COALESCE_MAX_BATCH = 500
+
+
+def parse_updates(items):
+    """[(id, it_text)] from a list of {'id', 'it_text'} objects, ValueError if malformed"""
+    if not isinstance(items, list):
+        raise ValueError('updates must be a list of {id, it_text} objects')
+    updates = []
+    for item in items:
+        if not isinstance(item, dict) or 'id' not in item:
+            raise ValueError('every update needs an id')
+        try:
+            translation_id = int(item['id'])
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid id: {item['id']!r}")
+        it_text = item.get('it_text')
+        updates.append((translation_id, '' if it_text is None else str(it_text)))
+    return updates
+
+
+def apply_translation_updates(cursor, updates):
+    """Write many (id, it_text) pairs with set-based statements.
+
+    Edits are staged in a temp table and applied with one UPDATE that also
+    works out is_modified against original_it_text for every row. When an id
+    appears twice the last edit wins. Returns {id: is_modified} for the rows
+    that exist; the caller commits.
+    """
+    # Take the write lock up front - upgrading a read snapshot later fails
+    # with "database is locked" when another edit committed in between
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS edit_staging (
+            id INTEGER PRIMARY KEY,
+            it_text TEXT
+        )
+    ''')
+    cursor.execute('DELETE FROM edit_staging')
+    cursor.executemany('INSERT OR REPLACE INTO edit_staging (id, it_text) VALUES (?, ?)', updates)
+
+    cursor.execute('''
+        UPDATE translations
+        SET it_text = (SELECT s.it_text FROM edit_staging s WHERE s.id = translations.id),
+            is_modified = (SELECT s.it_text IS NOT translations.original_it_text
+                           FROM edit_staging s WHERE s.id = translations.id)
+        WHERE id IN (SELECT id FROM edit_staging)
+    ''')
+
+    cursor.execute('''
+        SELECT t.id, t.is_modified
+        FROM translations t
+        JOIN edit_staging s ON s.id = t.id
+    ''')
+    results = dict(cursor.fetchall())
+    cursor.execute('DELETE FROM edit_staging')
+    return results
+
+
+class WriteCoalescer:
+    """Funnels single-cell edits through one writer thread.
+
+    Each caller blocks until the batch holding its edit is committed, so the
+    response still carries is_modified; edits that arrive close together share
+    one transaction and one fsync.
+    """
+
+    def __init__(self, window=COALESCE_WINDOW, max_batch=COALESCE_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = None
+        self.batches = 0
+        self.edits = 0
+
+    def submit(self, project, translation_id, it_text):
+        """Queue one edit and wait for it, returns is_modified or None if not found"""
+        item = {'project': project, 'id': translation_id, 'it_text': it_text, 'done': threading.Event()}
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._pending.append(item)
+            self._cond.notify()
+
+        item['done'].wait()
+        if 'error' in item:
+            raise item['error']
+        return item['result']
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Let the burst build up before committing
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            # One transaction per project shard in the batch
+            by_project = {}
+            for item in batch:
+                by_project.setdefault(item['project'], []).append(item)
+            for project, items in by_project.items():
+                self._flush(project, items)
+
+    def _flush(self, project, batch):
+        try:
+            conn = get_connection(project)
+            try:
+                results = apply_translation_updates(
+                    conn.cursor(), [(item['id'], item['it_text']) for item in batch]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            bump_data_version(project)
+            self.batches += 1
+            self.edits += len(batch)
+            for item in batch:
+                item['result'] = results.get(item['id'])
+        except Exception as e:
+            print(f"❌ Coalesced write of {len(batch)} edits failed: {e}")
+            for item in batch:
+                item['error'] = e
+        for item in batch:
+            item['done'].set()
+
+
+write_coalescer = WriteCoalescer()
+
+
+def update_translation_text(translation_id, it_text):
+    """Save one edit, through the coalescer when enabled. None if the id is unknown"""
+    if COALESCE_WRITES:
+        return write_coalescer.submit(current_project(), translation_id, it_text)
+
+    conn = get_connection()
+    try:
+        results = apply_translation_updates(conn.cursor(), [(translation_id, it_text)])
+        conn.commit()
+    finally:
+        conn.close()
+    if results:
+        bump_data_version()
+    return results.get(translation_id)
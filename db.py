@@ -0,0 +1,185 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from projects import project_path, current_project
+
+# Connections open at once per project shard (busy + idle); extra callers wait
+MAX_CONNECTIONS = int(os.environ.get('LOCZ_DB_POOL_SIZE', 16))
+CHECKOUT_TIMEOUT = 30
+# Prepared statements kept per connection, reused across requests
+STATEMENT_CACHE = 256
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',        # readers don't block the writer and vice versa
+    'PRAGMA synchronous = NORMAL',      # safe with WAL, one fsync per checkpoint
+    'PRAGMA cache_size = -32000',       # ~32 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',     # read pages through a 256 MB memory map
+    'PRAGMA busy_timeout = 10000',      # wait for locks instead of "database is locked"
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Called with a cursor the first time each shard is opened
+_schema_initializers = []
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+
+    checked_out = False
+    pool = None
+
+    def close(self):
+        self.pool.release(self)
+
+    def discard(self):
+        """Really close the underlying connection"""
+        super().close()
+
+    def __del__(self):
+        # Dropped without close() (e.g. a route raised) - give the slot back
+        if self.checked_out:
+            self.checked_out = False
+            try:
+                self.pool.forget()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """Tuned connections to one database shard"""
+
+    def __init__(self, path):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'reused': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'leaked': 0
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            factory=PooledConnection,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        start = time.perf_counter()
+        waited = not self._slots.acquire(blocking=False)
+        if waited and not self._slots.acquire(timeout=CHECKOUT_TIMEOUT):
+            raise sqlite3.OperationalError('Timed out waiting for a database connection')
+        wait = time.perf_counter() - start
+
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            reused = False
+        conn.checked_out = True
+
+        with self._stats_lock:
+            stats = self._stats
+            stats['checkouts'] += 1
+            stats['reused' if reused else 'created'] += 1
+            stats['in_use'] += 1
+            stats['peak_in_use'] = max(stats['peak_in_use'], stats['in_use'])
+            if waited:
+                stats['waits'] += 1
+                stats['wait_seconds'] += wait
+                stats['max_wait_seconds'] = max(stats['max_wait_seconds'], wait)
+        return conn
+
+    def release(self, conn):
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+
+        try:
+            # Never hand out a connection with someone else's half-done transaction
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.discard()
+        finally:
+            self._slots.release()
+            with self._stats_lock:
+                self._stats['in_use'] -= 1
+
+    def forget(self):
+        """A checked-out connection was garbage collected"""
+        self._slots.release()
+        with self._stats_lock:
+            self._stats['in_use'] -= 1
+            self._stats['leaked'] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['idle'] = self._idle.qsize()
+        stats['wait_seconds'] = round(stats['wait_seconds'], 4)
+        stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 4)
+        return stats
+
+
+def register_schema(initializer):
+    """Run initializer(cursor) on every shard the first time it is opened"""
+    _schema_initializers.append(initializer)
+
+
+def _get_pool(project):
+    with _pools_lock:
+        pool = _pools.get(project)
+        if pool is None:
+            pool = ConnectionPool(project_path(project))
+            conn = pool.acquire()
+            try:
+                cursor = conn.cursor()
+                for initializer in _schema_initializers:
+                    initializer(cursor)
+                conn.commit()
+            finally:
+                conn.close()
+            _pools[project] = pool
+        return pool
+
+
+def get_connection(project=None):
+    """Borrow a tuned connection to a project's shard (the current one by default).
+
+    close() returns it to the pool.
+    """
+    return _get_pool(project or current_project()).acquire()
+
+
+def get_pool_stats():
+    """Pool usage and checkout wait counters per open project"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {
+        'max_connections': MAX_CONNECTIONS,
+        'projects': {project: pool.stats() for project, pool in pools.items()}
+    }
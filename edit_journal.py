@@ -0,0 +1,162 @@
+import os
+from search_index import should_reindex, suspend_search_index, resume_search_index
+
+# Bounded retention: oldest operations are dropped past either limit
+JOURNAL_MAX_OPERATIONS = int(os.environ.get('LOCZ_JOURNAL_MAX_OPERATIONS', 20))
+JOURNAL_MAX_ROWS = int(os.environ.get('LOCZ_JOURNAL_MAX_ROWS', 2000000))
+
+
+class JournalError(Exception):
+    """Undo/redo asked for an operation that isn't next in line"""
+
+
+def init_edit_journal(cursor):
+    """Operation log plus one image row per (operation, translation)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edit_operations (
+            op_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT,
+            row_count INTEGER,
+            state TEXT DEFAULT 'applied',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # image_* holds the side of the change that is not in translations right
+    # now: the before-image while applied, the after-image once undone
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS edit_journal (
+            op_id INTEGER,
+            translation_id INTEGER,
+            image_text TEXT,
+            image_modified INTEGER,
+            PRIMARY KEY (op_id, translation_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def clear_edit_journal(cursor):
+    """Forget all operations - row ids and texts no longer match after an upload"""
+    cursor.execute('DELETE FROM edit_journal')
+    cursor.execute('DELETE FROM edit_operations')
+
+
+def record_operation(cursor, action, before_images):
+    """Journal a change about to be committed, returns its op_id.
+
+    before_images is a list of (translation_id, old_text, old_is_modified).
+    Starting a new operation discards anything that could still be redone.
+    """
+    cursor.execute("SELECT op_id FROM edit_operations WHERE state = 'undone'")
+    _delete_operations(cursor, [row[0] for row in cursor.fetchall()])
+
+    cursor.execute(
+        'INSERT INTO edit_operations (action, row_count) VALUES (?, ?)',
+        (action, len(before_images))
+    )
+    op_id = cursor.lastrowid
+    cursor.executemany(
+        'INSERT INTO edit_journal (op_id, translation_id, image_text, image_modified) VALUES (?, ?, ?, ?)',
+        [(op_id, row_id, text, is_modified) for row_id, text, is_modified in before_images]
+    )
+
+    _enforce_retention(cursor)
+    return op_id
+
+
+def _delete_operations(cursor, op_ids):
+    for op_id in op_ids:
+        cursor.execute('DELETE FROM edit_journal WHERE op_id = ?', (op_id,))
+        cursor.execute('DELETE FROM edit_operations WHERE op_id = ?', (op_id,))
+
+
+def _enforce_retention(cursor):
+    cursor.execute('SELECT op_id, row_count FROM edit_operations ORDER BY op_id DESC')
+    kept_rows = 0
+    expired = []
+    for position, (op_id, row_count) in enumerate(cursor.fetchall()):
+        kept_rows += row_count or 0
+        # Always keep the newest operation, however large
+        if position > 0 and (position >= JOURNAL_MAX_OPERATIONS or kept_rows > JOURNAL_MAX_ROWS):
+            expired.append(op_id)
+    if expired:
+        _delete_operations(cursor, expired)
+        print(f"🧹 Dropped {len(expired)} old operations from the edit journal")
+
+
+def _swap_images(cursor, op_id):
+    """Exchange the journal images with the live rows, returns the rows touched"""
+    cursor.execute('DROP TABLE IF EXISTS temp.journal_swap')
+    cursor.execute('''
+        CREATE TEMP TABLE journal_swap AS
+        SELECT t.id, t.it_text, t.is_modified, j.image_text, j.image_modified
+        FROM edit_journal j
+        JOIN translations t ON t.id = j.translation_id
+        WHERE j.op_id = ?
+    ''', (op_id,))
+    cursor.execute('CREATE UNIQUE INDEX temp.journal_swap_id ON journal_swap (id)')
+    cursor.execute('SELECT COUNT(*) FROM journal_swap')
+    reindex = should_reindex(cursor, cursor.fetchone()[0])
+
+    if reindex:
+        suspend_search_index(cursor)
+    cursor.execute('''
+        UPDATE translations
+        SET it_text = (SELECT s.image_text FROM journal_swap s WHERE s.id = translations.id),
+            is_modified = (SELECT s.image_modified FROM journal_swap s WHERE s.id = translations.id)
+        WHERE id IN (SELECT id FROM journal_swap)
+    ''')
+    if reindex:
+        resume_search_index(cursor)
+    cursor.execute('''
+        UPDATE edit_journal
+        SET image_text = (SELECT s.it_text FROM journal_swap s WHERE s.id = edit_journal.translation_id),
+            image_modified = (SELECT s.is_modified FROM journal_swap s WHERE s.id = edit_journal.translation_id)
+        WHERE op_id = ? AND translation_id IN (SELECT id FROM journal_swap)
+    ''', (op_id,))
+
+    cursor.execute('SELECT id, image_text, image_modified FROM journal_swap')
+    rows = [{'id': row_id, 'new_text': text, 'is_modified': is_modified}
+            for row_id, text, is_modified in cursor.fetchall()]
+    cursor.execute('DROP TABLE temp.journal_swap')
+    return rows
+
+
+def undo_operation(cursor, op_id):
+    """Restore the before-images of the newest applied operation; the caller commits"""
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute("SELECT MAX(op_id) FROM edit_operations WHERE state = 'applied'")
+    if cursor.fetchone()[0] != op_id:
+        raise JournalError(f'Operation {op_id} is not the latest change that can be undone')
+
+    rows = _swap_images(cursor, op_id)
+    cursor.execute("UPDATE edit_operations SET state = 'undone' WHERE op_id = ?", (op_id,))
+    return rows
+
+
+def redo_operation(cursor, op_id):
+    """Re-apply the most recently undone operation; the caller commits"""
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute("SELECT MIN(op_id) FROM edit_operations WHERE state = 'undone'")
+    if cursor.fetchone()[0] != op_id:
+        raise JournalError(f'Operation {op_id} is not the next change that can be redone')
+
+    rows = _swap_images(cursor, op_id)
+    cursor.execute("UPDATE edit_operations SET state = 'applied' WHERE op_id = ?", (op_id,))
+    return rows
+
+
+def list_operations(cursor):
+    cursor.execute('''
+        SELECT op_id, action, row_count, state, created_at
+        FROM edit_operations
+        ORDER BY op_id DESC
+    ''')
+    return [{
+        'op_id': op_id,
+        'action': action,
+        'row_count': row_count,
+        'state': state,
+        'created_at': created_at
+    } for op_id, action, row_count, state, created_at in cursor.fetchall()]
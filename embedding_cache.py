@@ -0,0 +1,52 @@
+import hashlib
+import unicodedata
+import numpy as np
+
+# SQLite's default limit on bound parameters is 999 on older builds
+LOOKUP_BATCH = 500
+
+
+def normalize_text(text):
+    """Normalize EN text before hashing and encoding"""
+    return unicodedata.normalize('NFC', (text or '').strip())
+
+
+def text_hash(text, model_id):
+    """Content address of a normalized text for a given model"""
+    return hashlib.sha1(f"{model_id}\0{text}".encode('utf-8')).hexdigest()
+
+
+def init_embedding_cache(cursor):
+    """Create the persistent embedding cache table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            text_hash TEXT PRIMARY KEY,
+            model_id TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+
+
+def lookup_embeddings(cursor, hashes):
+    """Fetch cached vectors, returns {text_hash: np.ndarray} for the hits"""
+    found = {}
+    hashes = list(hashes)
+    for i in range(0, len(hashes), LOOKUP_BATCH):
+        batch = hashes[i:i + LOOKUP_BATCH]
+        placeholders = ','.join(['?' for _ in batch])
+        cursor.execute(f'''
+            SELECT text_hash, embedding FROM embedding_cache
+            WHERE text_hash IN ({placeholders})
+        ''', batch)
+        for key, blob in cursor.fetchall():
+            found[key] = np.frombuffer(blob, dtype=np.float32)
+    return found
+
+
+def store_embeddings(cursor, model_id, vectors):
+    """Add freshly encoded {text_hash: vector} entries to the cache"""
+    cursor.executemany('''
+        INSERT OR IGNORE INTO embedding_cache (text_hash, model_id, embedding)
+        VALUES (?, ?, ?)
+    ''', [(key, model_id, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()])
@@ -0,0 +1,318 @@
+import threading
+import numpy as np
+from ann_index import IVFIndex, ANN_ENABLED, ANN_MIN_ROWS, ANN_NPROBE, ann_path, fingerprint
+from projects import current_project
+from vector_store import QUANTIZATION, QuantizedVectors, get_session_file, open_vectors
+
+# Scoring bands, same as the original per-row loop
+EXACT_SCORE = 1.0
+CONTAINS_BASE = 0.95
+SEMANTIC_BASE = 0.20
+SEMANTIC_WEIGHT = 0.69
+
+# Separates texts in the substring corpus, never part of a real string
+SEPARATOR = '\x00'
+
+# With a quantized copy, this many times max_results of the best rows by
+# approximate score are rescored exactly against the float32 file
+RESCORE_FACTOR = 4
+# Rows this far under the threshold by approximate score may still pass it
+RESCORE_MARGIN = 0.02
+
+
+class EmbeddingIndex:
+    """Search view over a project's embeddings.
+
+    The matrix is a read-only memory map of the session's vector file (rows
+    are stored normalized), so loading copies nothing and a query is a single
+    matrix-vector product. Per-row arrays follow file order; rows no string
+    points at any more are masked out. EN texts are kept lowercased in one
+    separator-joined string for substring boosting. New rows are picked up by
+    embedding id, deletions force a full reload.
+
+    For large projects an IVF index narrows the semantic scoring to a few
+    lists; until one is built for the current rows, scoring stays exact.
+    With float16 or int8 quantization (LOCZ_EMBED_QUANTIZATION) the first
+    pass scans a smaller in-memory copy instead of the file, and only the
+    best candidates are read back at float32 to rank them.
+    There is one index per project, see get_embedding_index.
+    """
+
+    def __init__(self, project, quantization=None):
+        self.project = project
+        self.quantization = quantization or QUANTIZATION
+        self.lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._needs_reload = True
+        self._has_new_rows = False
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.quantized = None
+        self.str_ids = np.array([], dtype=object)
+        self.live = np.array([], dtype=bool)
+        self.dead_rows = 0
+        self.text_lengths = np.array([], dtype=np.int64)
+        self.offsets = np.array([], dtype=np.int64)
+        self.corpus = ''
+        self.last_id = 0
+        self.session = None
+        self.ann = None
+
+    def __len__(self):
+        return len(self.str_ids) - self.dead_rows
+
+    @property
+    def version(self):
+        """Changes whenever the searchable rows do, for caching results"""
+        with self.lock:
+            return self.session, self.generation, self.last_id
+
+    def notify_added(self):
+        """Embeddings were inserted, pull them on the next refresh"""
+        self._has_new_rows = True
+
+    def invalidate(self):
+        """Embeddings or translations were deleted, reload everything.
+
+        The rows are dropped right away so the vector file is no longer
+        mapped and can be deleted (Windows refuses to while it is).
+        """
+        with self._refresh_lock:
+            with self.lock:
+                self._reset()
+                self.generation += 1
+            self._needs_reload = True
+
+    def refresh(self, conn):
+        """Bring the index up to date with the embeddings table"""
+        if not (self._needs_reload or self._has_new_rows):
+            return
+
+        with self._refresh_lock:
+            reload = self._needs_reload
+            self._needs_reload = False
+            self._has_new_rows = False
+
+            cursor = conn.cursor()
+            cursor.execute('SELECT upload_session FROM embeddings ORDER BY id DESC LIMIT 1')
+            latest = cursor.fetchone()
+            session = latest[0] if latest else None
+            session_file = get_session_file(cursor, session) if session else None
+            # A new session means a new file
+            reload = reload or session != self.session
+
+            last_id = 0 if reload else self.last_id
+            rows = []
+            if session_file:
+                cursor.execute('''
+                    SELECT e.id, e.vector_row, e.str_id, t.en_text
+                    FROM embeddings e
+                    JOIN translations t ON e.str_id = t.str_id
+                    WHERE e.upload_session = ? AND e.id > ?
+                    ORDER BY e.vector_row
+                ''', (session, last_id))
+                rows = cursor.fetchall()
+
+            if reload:
+                with self.lock:
+                    self._reset()
+                    self.session = session
+                    self.generation += 1
+            if rows:
+                self._append(rows, session_file)
+            if reload:
+                self._attach_persisted_ann()
+            print(f"🧭 Embedding index {'reloaded' if reload else 'refreshed'} for {self.project}: {len(self)} vectors")
+
+    def _attach_persisted_ann(self):
+        """Reuse the IVF index on disk if it was built for these exact rows"""
+        if not ANN_ENABLED:
+            return
+        ann = IVFIndex.load(ann_path(self.project))
+        if ann is None or ann.row_count > len(self.str_ids):
+            return
+        if fingerprint(self.str_ids[:ann.row_count]) == ann.fingerprint:
+            with self.lock:
+                self.ann = ann
+            print(f"🗂️ Loaded IVF index from disk ({ann.row_count} vectors)")
+
+    def build_ann(self):
+        """Build and persist an IVF index for the current rows (background job)"""
+        with self.lock:
+            matrix, str_ids, generation = self.matrix, self.str_ids, self.generation
+        if not ANN_ENABLED or len(str_ids) < ANN_MIN_ROWS:
+            return None
+
+        ann = IVFIndex.build(matrix, str_ids)
+        ann.save(ann_path(self.project))
+        with self.lock:
+            # Rows were reloaded meanwhile, the next job will rebuild
+            if self.generation == generation:
+                self.ann = ann
+        return ann
+
+    def _append(self, rows, session_file):
+        """Map the file up to the newest row and fill in the rows' strings and texts.
+
+        Rows are appended to the file in order, so new rows always come after
+        the ones already mapped; gaps are rows nothing refers to.
+        """
+        file_name, dim = session_file
+        ids, vector_rows, str_ids, texts = zip(*rows)
+        vector_rows = np.array(vector_rows, dtype=np.int64)
+        start_row = len(self.str_ids)
+        end_row = int(vector_rows[-1]) + 1
+        positions = vector_rows - start_row
+
+        count = end_row - start_row
+        new_str_ids = np.full(count, None, dtype=object)
+        new_str_ids[positions] = str_ids
+        live = np.zeros(count, dtype=bool)
+        live[positions] = True
+
+        all_texts = [''] * count
+        for position, text in zip(positions, texts):
+            all_texts[position] = (text or '').strip().lower().replace(SEPARATOR, ' ')
+        lengths = np.array([len(text) for text in all_texts], dtype=np.int64)
+
+        matrix = open_vectors(self.project, file_name, dim, end_row)
+        quantized = self.quantized
+        if self.quantization != 'float32':
+            quantized = (quantized or QuantizedVectors(self.quantization, dim)).extended(matrix[start_row:])
+        with self.lock:
+            start = len(self.corpus)
+            offsets = start + np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+
+            self.matrix = matrix
+            self.quantized = quantized
+            self.str_ids = np.concatenate([self.str_ids, new_str_ids])
+            self.live = np.concatenate([self.live, live])
+            self.dead_rows += count - len(rows)
+            self.text_lengths = np.concatenate([self.text_lengths, lengths])
+            self.offsets = np.concatenate([self.offsets, offsets])
+            self.corpus += SEPARATOR.join(all_texts) + SEPARATOR
+            self.last_id = max(self.last_id, max(ids))
+
+    def vector(self, row):
+        """Stored (normalized) vector of a file row, None if it isn't mapped yet"""
+        with self.lock:
+            matrix = self.matrix
+        return matrix[row] if 0 <= row < len(matrix) else None
+
+    def memory_stats(self):
+        """Bytes the first scoring pass reads per query, against the float32 vectors"""
+        with self.lock:
+            matrix, quantized = self.matrix, self.quantized
+        float32_bytes = matrix.nbytes
+        return {
+            'quantization': self.quantization,
+            'vectors': len(self),
+            'float32_bytes': float32_bytes,
+            'search_bytes': quantized.nbytes if quantized is not None else float32_bytes
+        }
+
+    def _rescore(self, similarities, matrix, query, threshold, max_results):
+        """Exact similarities for the best approximate rows, -1 for every other row"""
+        candidates = np.flatnonzero(similarities > threshold - RESCORE_MARGIN)
+        limit = max_results * RESCORE_FACTOR
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-similarities[candidates], limit - 1)[:limit]]
+        # Ascending rows read the mapped file front to back
+        candidates.sort()
+        rescored = np.full(len(similarities), -1.0, dtype=np.float32)
+        rescored[candidates] = matrix[candidates] @ query
+        return rescored
+
+    def _substring_rows(self, needle, corpus, offsets):
+        """Rows whose text contains needle, found by scanning the joined corpus"""
+        positions = []
+        pos = corpus.find(needle)
+        while pos != -1:
+            positions.append(pos)
+            pos = corpus.find(needle, pos + len(needle))
+        if not positions:
+            return np.array([], dtype=np.int64)
+        # Map every hit back to its row at once, a row can match more than once
+        return np.unique(np.searchsorted(offsets, positions, side='right') - 1)
+
+    def search(self, query_vector, search_text, threshold=0.4, max_results=300, nprobe=ANN_NPROBE, rescore=True):
+        """Score rows against the query, returns [(str_id, score, match_type)].
+
+        rescore=False ranks by the quantized scores alone (for benchmarking).
+        """
+        with self.lock:
+            matrix, quantized, str_ids, ann = self.matrix, self.quantized, self.str_ids, self.ann
+            live, dead_rows = self.live, self.dead_rows
+            lengths, offsets, corpus = self.text_lengths, self.offsets, self.corpus
+
+        if len(str_ids) == dead_rows:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        # 1. Semantic similarity - every row in one product, or only the probed
+        # IVF lists plus rows added after the IVF was built
+        if ann is not None:
+            rows = np.concatenate([ann.candidates(query, nprobe), np.arange(ann.row_count, len(str_ids))])
+            similarities = np.full(len(str_ids), -1.0, dtype=np.float32)
+            similarities[rows] = quantized.dot(query, rows) if quantized is not None else matrix[rows] @ query
+        else:
+            similarities = quantized.dot(query) if quantized is not None else matrix @ query
+        if dead_rows:
+            similarities[~live] = -1.0
+        if quantized is not None and rescore:
+            similarities = self._rescore(similarities, matrix, query, threshold, max_results)
+        scores = np.where(similarities > threshold, SEMANTIC_BASE + similarities * SEMANTIC_WEIGHT, -np.inf)
+        match_types = np.zeros(len(scores), dtype=np.int8)  # 0 semantic, 1 contains, 2 exact
+
+        # 2. Exact/substring matching overrides the semantic score
+        needle = search_text.lower().replace(SEPARATOR, ' ')
+        if needle:
+            rows = self._substring_rows(needle, corpus, offsets)
+            if len(rows):
+                row_lengths = lengths[rows]
+                scores[rows] = CONTAINS_BASE + (len(search_text) / np.maximum(row_lengths, 1)) * 0.04
+                match_types[rows] = 1
+
+                exact = rows[row_lengths == len(needle)]
+                scores[exact] = EXACT_SCORE
+                match_types[exact] = 2
+
+        # Top-k without sorting the whole array; equal scores (duplicate texts)
+        # go to the lowest rows, so the cut and order don't depend on the scan
+        candidates = np.flatnonzero(np.isfinite(scores))
+        if len(candidates) > max_results:
+            candidate_scores = scores[candidates]
+            kth = np.partition(-candidate_scores, max_results - 1)[max_results - 1]
+            above = candidates[-candidate_scores < kth]
+            tied = candidates[-candidate_scores == kth][:max_results - len(above)]
+            candidates = np.concatenate([above, tied])
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        results = []
+        for row in candidates:
+            if match_types[row] == 2:
+                match_type = 'exact'
+            elif match_types[row] == 1:
+                match_type = 'contains'
+            else:
+                match_type = f"semantic_{similarities[row]:.2f}"
+            results.append((str_ids[row], float(scores[row]), match_type))
+        return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_embedding_index(project=None):
+    """The resident index of a project (the current one by default)"""
+    project = project or current_project()
+    with _indexes_lock:
+        if project not in _indexes:
+            _indexes[project] = EmbeddingIndex(project)
+        return _indexes[project]
@@ -0,0 +1,84 @@
+import threading
+import time
+
+MODEL_ID = 'all-MiniLM-L6-v2'
+
+_model = None
+_load_lock = threading.Lock()
+# One encode at a time - the background job and search requests share the model
+_encode_lock = threading.Lock()
+
+_stats = {
+    'loaded': False,
+    'load_failed': False,
+    'load_seconds': None,
+    'encode_calls': 0,
+    'encoded_texts': 0,
+    'encode_seconds': 0.0,
+    'last_encode_seconds': None
+}
+
+
+def get_model():
+    """Return the process-wide SentenceTransformer, loading it on first use.
+
+    Returns None if the model could not be loaded (no retry until restart).
+    """
+    global _model
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                start = time.perf_counter()
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    _model = SentenceTransformer(MODEL_ID)
+                    _stats['loaded'] = True
+                    print(f"✅ Sentence Transformer model loaded in {time.perf_counter() - start:.1f}s")
+                except Exception as e:
+                    print(f"❌ Could not load Sentence Transformer: {e}")
+                    _model = False
+                    _stats['load_failed'] = True
+                _stats['load_seconds'] = round(time.perf_counter() - start, 3)
+    return _model if _model else None
+
+
+def encode_texts(texts):
+    """Encode texts with the shared model, returns None if it isn't available"""
+    model = get_model()
+    if model is None:
+        return None
+
+    with _encode_lock:
+        start = time.perf_counter()
+        embeddings = model.encode(texts, show_progress_bar=False)
+        elapsed = time.perf_counter() - start
+
+        _stats['encode_calls'] += 1
+        _stats['encoded_texts'] += len(texts)
+        _stats['encode_seconds'] += elapsed
+        _stats['last_encode_seconds'] = round(elapsed, 4)
+
+    return embeddings
+
+
+def warm_up_model():
+    """Load the model and run one encode in a background thread"""
+    def _warm_up():
+        if get_model() is not None:
+            encode_texts(['warm up'])
+            print("🔥 Embedding model warmed up")
+
+    thread = threading.Thread(target=_warm_up)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def get_model_stats():
+    """Snapshot of load and encode timings"""
+    stats = dict(_stats)
+    stats['model_id'] = MODEL_ID
+    stats['encode_seconds'] = round(stats['encode_seconds'], 3)
+    if stats['encoded_texts']:
+        stats['ms_per_text'] = round(stats['encode_seconds'] * 1000 / stats['encoded_texts'], 3)
+    return stats
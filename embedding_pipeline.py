@@ -0,0 +1,302 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from db import get_connection
+from embedding_cache import normalize_text, text_hash, lookup_embeddings, store_embeddings
+from embedding_model import MODEL_ID, encode_texts
+from progress import progress_board
+from vector_store import VectorWriter
+
+# Encoder processes; 0 encodes in this process with the shared model
+EMBED_PROCESSES = int(os.environ.get('LOCZ_EMBED_PROCESSES', 0))
+
+# Texts are encoded shortest first, so batches are sized by characters rather
+# than count: many short strings or a few long ones, with little padding
+BATCH_CHARS = 12000
+MIN_BATCH_CHARS = 1000
+MAX_BATCH_CHARS = 200000
+MAX_BATCH = 512
+# Batch size is tuned towards this encode time, keeping cancellation and
+# pauses for interactive searches responsive
+TARGET_BATCH_SECONDS = 0.5
+
+# Cache keys looked up per query by the reader
+READ_CHUNK = 2000
+# Batches queued for the writer before the encoder waits
+WRITE_QUEUE_SIZE = 8
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_worker_model = None
+
+
+def _init_worker(model_id, threads):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_id)
+
+
+def _encode_in_worker(texts):
+    start = time.perf_counter()
+    vectors = _worker_model.encode(texts, show_progress_bar=False)
+    return np.asarray(vectors, dtype=np.float32), time.perf_counter() - start
+
+
+def _get_process_pool():
+    """Encoder processes, started once and kept for later uploads"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Share the cores out instead of every process using all of them
+            threads = max(1, (os.cpu_count() or 1) // EMBED_PROCESSES)
+            _process_pool = ProcessPoolExecutor(
+                max_workers=EMBED_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(MODEL_ID, threads)
+            )
+            print(f"⚙️ Started {EMBED_PROCESSES} encoder processes ({threads} threads each)")
+        return _process_pool
+
+
+def _encode_here(texts):
+    start = time.perf_counter()
+    vectors = encode_texts(texts)
+    if vectors is None:
+        raise RuntimeError('Embedding model is not available')
+    return vectors, time.perf_counter() - start
+
+
+class BatchSizer:
+    """Cuts length-sorted texts into batches, resizing them from measured encode times"""
+
+    def __init__(self, keys, texts):
+        self.keys = keys
+        self.texts = texts
+        self.position = 0
+        self.budget = BATCH_CHARS
+
+    def next_batch(self):
+        if self.position >= len(self.keys):
+            return None
+        batch = []
+        chars = 0
+        while self.position < len(self.keys) and len(batch) < MAX_BATCH:
+            key = self.keys[self.position]
+            size = len(self.texts[key]) or 1
+            if batch and chars + size > self.budget:
+                break
+            batch.append(key)
+            chars += size
+            self.position += 1
+        return batch
+
+    def record(self, seconds):
+        # Move towards the target time, at most doubling or halving per batch
+        factor = min(2.0, max(0.5, TARGET_BATCH_SECONDS / max(seconds, 1e-3)))
+        self.budget = int(min(MAX_BATCH_CHARS, max(MIN_BATCH_CHARS, self.budget * factor)))
+
+
+class EmbeddingWriter:
+    """Writer stage: appends vectors to the session's file and maps them with executemany"""
+
+    def __init__(self, project, session_id, total, job=None, on_written=None, already_done=0):
+        self.project = project
+        self.session_id = session_id
+        self.total = total
+        self.already_done = already_done
+        self.job = job
+        self.on_written = on_written
+        self.written = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.error = None
+        self.started = time.perf_counter()
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name='embedding-writer', daemon=True)
+        self._thread.start()
+
+    @property
+    def strings_per_second(self):
+        elapsed = time.perf_counter() - self.started
+        return round(self.written / elapsed, 1) if elapsed > 0 else 0.0
+
+    def put(self, vectors, hits=0, fresh=None):
+        """Queue [(str_id, vector)] for storage, plus newly encoded {text_hash: vector}"""
+        self._put((vectors, hits, fresh))
+
+    def close(self):
+        """Wait for everything queued to be written"""
+        if self._thread.is_alive():
+            self._put(None)
+            self._thread.join()
+        if self.error:
+            raise self.error
+
+    def _put(self, item):
+        while True:
+            if not self._thread.is_alive():
+                raise self.error or RuntimeError('Embedding writer stopped')
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self):
+        conn = get_connection(self.project)
+        cursor = conn.cursor()
+        vector_writer = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                vectors, hits, fresh = item
+
+                str_ids = [str_id for str_id, _ in vectors]
+                matrix = np.stack([vector for _, vector in vectors])
+                if vector_writer is None:
+                    vector_writer = VectorWriter(cursor, self.project, self.session_id, matrix.shape[1])
+                first = vector_writer.append(matrix)
+                cursor.executemany('''
+                    INSERT INTO embeddings (str_id, upload_session, vector_row)
+                    VALUES (?, ?, ?)
+                ''', [(str_id, self.session_id, first + i) for i, str_id in enumerate(str_ids)])
+                if fresh:
+                    store_embeddings(cursor, MODEL_ID, fresh)
+
+                self.written += len(vectors)
+                self.cache_hits += hits
+                self.cache_misses += len(fresh or ())
+                done = self.already_done + self.written
+                cursor.execute('''
+                    UPDATE processing_status
+                    SET processed_strings = ?, cache_hits = ?, cache_misses = ?, strings_per_second = ?
+                    WHERE session_id = ?
+                ''', (done, self.cache_hits, self.cache_misses, self.strings_per_second, self.session_id))
+                conn.commit()
+                progress_board.update(self.project, processed=done, cache_hits=self.cache_hits,
+                                      cache_misses=self.cache_misses, strings_per_second=self.strings_per_second)
+
+                if self.on_written:
+                    self.on_written()
+                if self.job:
+                    self.job.set_progress(done, message=f'{self.strings_per_second} strings/s, '
+                                                        f'{self.cache_hits} cached / {self.cache_misses} encoded')
+                print(f"📊 Processed {done}/{self.total} embeddings ({done/self.total*100:.1f}%, "
+                      f"{self.strings_per_second} strings/s)")
+        except Exception as e:
+            self.error = e
+        finally:
+            if vector_writer:
+                vector_writer.close()
+            conn.close()
+
+
+def _read_cached(by_key, project, writer):
+    """Reader stage: hand cache hits straight to the writer, returns the keys to encode"""
+    keys = list(by_key)
+    missing = []
+    conn = get_connection(project)
+    try:
+        cursor = conn.cursor()
+        for i in range(0, len(keys), READ_CHUNK):
+            chunk = keys[i:i + READ_CHUNK]
+            cached = lookup_embeddings(cursor, chunk)
+            vectors = [(str_id, cached[key]) for key in chunk if key in cached for str_id in by_key[key]]
+            if vectors:
+                writer.put(vectors, hits=len(vectors))
+            missing.extend(key for key in chunk if key not in cached)
+    finally:
+        conn.close()
+    return missing
+
+
+def _encoded_batch(batch, vectors, by_key):
+    """Writer input for one encoded batch; repeats of a text count as cache hits"""
+    rows = [(str_id, vector) for key, vector in zip(batch, vectors) for str_id in by_key[key]]
+    return rows, len(rows) - len(batch), dict(zip(batch, vectors))
+
+
+def embed_rows(rows, session_id, project, job=None, on_written=None, already_done=0):
+    """Embed a session's (str_id, en_text) rows and store the vectors.
+
+    Reading and cache lookups, encoding and writing run as a pipeline: the
+    writer thread stores each batch while the next one is encoded. Cache
+    misses are encoded shortest first in adaptive batches, in worker
+    processes when LOCZ_EMBED_PROCESSES is set. already_done is the number of
+    the session's strings embedded before, for progress. Returns counts and
+    throughput for this call.
+    """
+    by_key = {}
+    texts = {}
+    for str_id, en_text in rows:
+        text = normalize_text(en_text)
+        key = text_hash(text, MODEL_ID)
+        by_key.setdefault(key, []).append(str_id)
+        texts[key] = text
+
+    writer = EmbeddingWriter(project, session_id, already_done + len(rows), job, on_written, already_done)
+    in_flight = deque()
+    try:
+        missing = _read_cached(by_key, project, writer)
+        missing.sort(key=lambda key: len(texts[key]))
+        sizer = BatchSizer(missing, texts)
+
+        if EMBED_PROCESSES > 0:
+            pool = _get_process_pool()
+            while True:
+                # Keep every process busy with one batch queued behind it
+                while len(in_flight) < EMBED_PROCESSES * 2:
+                    batch = sizer.next_batch()
+                    if batch is None:
+                        break
+                    in_flight.append((batch, pool.submit(_encode_in_worker, [texts[key] for key in batch])))
+                if not in_flight:
+                    break
+                if job:
+                    job.checkpoint()
+                batch, future = in_flight.popleft()
+                vectors, seconds = future.result()
+                sizer.record(seconds)
+                writer.put(*_encoded_batch(batch, vectors, by_key))
+        else:
+            while True:
+                if job:
+                    job.checkpoint()
+                batch = sizer.next_batch()
+                if batch is None:
+                    break
+                vectors, seconds = _encode_here([texts[key] for key in batch])
+                sizer.record(seconds)
+                writer.put(*_encoded_batch(batch, vectors, by_key))
+    except BaseException:
+        # Don't leave batches in flight; whatever was queued still gets written
+        for _, future in in_flight:
+            future.cancel()
+        # The error that stopped the run is the one to report, not a failed flush
+        try:
+            writer.close()
+        except Exception as e:
+            print(f"❌ Could not flush embeddings after the run stopped: {e}")
+        raise
+
+    writer.close()
+    return {
+        'processed': writer.written,
+        'cache_hits': writer.cache_hits,
+        'cache_misses': writer.cache_misses,
+        'seconds': round(time.perf_counter() - writer.started, 2),
+        'strings_per_second': writer.strings_per_second
+    }
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from db import get_connection
+
+# Same columns as the original spreadsheet, so the export can be re-imported
+EXPORT_COLUMNS = ['SOURCE', '字符串', 'EN', 'Italian']
+
+# Rows pulled from the cursor per fetchmany
+FETCH_SIZE = 2000
+# Bytes per chunk of the streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+MODIFIED_ROWS_QUERY = '''
+    SELECT '' AS SOURCE, str_id, en_text, it_text
+    FROM translations
+    WHERE is_modified = 1
+    ORDER BY str_id
+'''
+
+
+def has_modified_rows(cursor):
+    cursor.execute('SELECT 1 FROM translations WHERE is_modified = 1 LIMIT 1')
+    return cursor.fetchone() is not None
+
+
+def iter_rows(cursor, query=MODIFIED_ROWS_QUERY, params=()):
+    """Rows straight from the cursor, FETCH_SIZE at a time"""
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def _buffered(pieces):
+    """Join small string pieces into STREAM_CHUNK_SIZE byte chunks"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_csv(rows):
+    def lines():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        # BOM so Excel opens the Chinese header as UTF-8
+        yield '\ufeff'
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(['' if value is None else value for value in row])
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
+    return _buffered(lines())
+
+
+def iter_jsonl(rows):
+    return _buffered(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows
+    )
+
+
+def _xlsx_value(value):
+    if isinstance(value, str):
+        # Control characters are not allowed in xlsx cells
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def iter_xlsx(rows):
+    """Write rows with openpyxl's write-only workbook, then stream the file.
+
+    The workbook has to be a seekable zip, so it goes to a temp file that is
+    removed once streaming finishes or the client goes away.
+    """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(EXPORT_COLUMNS)
+        for row in rows:
+            sheet.append([_xlsx_value(value) for value in row])
+        workbook.save(path)
+
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def iter_export(export_format, project):
+    """Encoded chunks of a project's modified rows in the given format.
+
+    The connection is opened on the first chunk and closed when the stream
+    ends, so nothing is held for a response that never starts.
+    """
+    writers = {'xlsx': iter_xlsx, 'csv': iter_csv, 'jsonl': iter_jsonl}
+    conn = get_connection(project)
+    try:
+        yield from writers[export_format](iter_rows(conn.cursor()))
+    finally:
+        conn.close()
@@ -0,0 +1,341 @@
+import threading
+import time
+import numpy as np
+from db import get_connection
+from projects import current_project
+
+try:
+    from Levenshtein import distance as _levenshtein_c
+except ImportError:
+    _levenshtein_c = None
+
+# Percentage of the longer text that must survive unedited
+MIN_SCORE = 75
+MAX_MATCHES = 10
+MAX_LIMIT = 50
+# Texts that get an exact edit distance per lookup, most shared trigrams first
+MAX_CANDIDATES = 200
+# Rows fetched per matched text to collect its translations
+MAX_ROWS_PER_TEXT = 20
+READ_CHUNK = 50000
+# Texts turned into trigram postings at a time, bounds the build's memory
+BUILD_CHUNK = 100000
+ID_CHUNK = 500
+
+# Texts are padded so that short ones have trigrams and edits at either end
+# count; the separator never occurs in a normalized text
+PAD_START = '\x02\x02'
+PAD_END = '\x03\x03'
+SEPARATOR = '\x00'
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Bounds err on the loose side of float rounding, the exact score decides
+ROUNDING = 1e-9
+
+
+def normalize(text):
+    """Matching ignores case and runs of whitespace"""
+    return ' '.join((text or '').replace(SEPARATOR, ' ').lower().split())
+
+
+def _myers_distance(a, b):
+    """Levenshtein distance, bit-parallel over the shorter string (Hyyrö's variant of Myers)"""
+    if len(a) < len(b):
+        a, b = b, a
+    m = len(b)
+    if m == 0:
+        return len(a)
+
+    peq = {}
+    for i, char in enumerate(b):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn, distance = full, 0, m
+    for char in a:
+        eq = peq.get(char, 0)
+        x = eq | vn
+        d0 = (((x & vp) + vp) ^ vp) | x
+        hp = (vn | ~(d0 | vp)) & full
+        hn = d0 & vp
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        hp = ((hp << 1) | 1) & full
+        hn = (hn << 1) & full
+        vp = (hn | ~(d0 | hp)) & full
+        vn = hp & d0
+    return distance
+
+
+def levenshtein_distance(a, b):
+    """Edit distance, with python-Levenshtein when it's installed"""
+    if _levenshtein_c is not None:
+        return _levenshtein_c(a, b)
+    return _myers_distance(a, b)
+
+
+def _trigram_keys(joined):
+    """(hashed trigram, text number) for every trigram of separator-joined padded texts"""
+    codes = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    valid = (codes[:-2] != 0) & (codes[1:-1] != 0) & (codes[2:] != 0)
+    packed = (codes[:-2] << np.uint64(42)) | (codes[1:-1] << np.uint64(21)) | codes[2:]
+    # Hash collisions only ever add candidates, the count filter stays a lower bound
+    keys = (packed * HASH_MULTIPLIER) >> np.uint64(32)
+    text_numbers = np.cumsum(codes == 0)[:-2].astype(np.uint64)
+    return keys[valid], text_numbers[valid]
+
+
+def _query_keys(text):
+    keys, _ = _trigram_keys(PAD_START + text + PAD_END)
+    return np.unique(keys)
+
+
+class FuzzyIndex:
+    """Character trigram inverted index (CSR postings) over a project's distinct EN texts.
+
+    Trigram counts filter the candidates; only the best MAX_CANDIDATES get an
+    exact edit distance. Built on first use, uploads invalidate it.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._built = False
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        self.corpus = ''
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.int32)
+        self.row_offsets = np.zeros(1, dtype=np.int64)
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        self.gram_keys = np.zeros(0, dtype=np.uint64)
+        self.gram_offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def invalidate(self):
+        """EN texts changed (upload), rebuild on the next lookup"""
+        with self._lock:
+            self._built = False
+            self.generation += 1
+
+    def ensure_built(self):
+        if self._built:
+            return
+        with self._build_lock:
+            if self._built:
+                return
+            with self._lock:
+                generation = self.generation
+            self._build()
+            with self._lock:
+                # Another upload came in meanwhile, the next lookup rebuilds
+                self._built = self.generation == generation
+
+    def _build(self):
+        start = time.perf_counter()
+        by_text = {}
+        conn = get_connection(self.project)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, en_text FROM translations ORDER BY id')
+            while True:
+                rows = cursor.fetchmany(READ_CHUNK)
+                if not rows:
+                    break
+                for row_id, en_text in rows:
+                    text = normalize(en_text)
+                    if text:
+                        by_text.setdefault(text, []).append(row_id)
+        finally:
+            conn.close()
+
+        # Numbered shortest first, so every length window is one range of texts
+        texts = sorted(by_text, key=len)
+        lengths = np.array([len(text) for text in texts], dtype=np.int32)
+        offsets = np.concatenate(([0], np.cumsum(lengths.astype(np.int64) + 1)[:-1]))
+        row_counts = np.array([len(by_text[text]) for text in texts], dtype=np.int64)
+        row_offsets = np.concatenate(([0], np.cumsum(row_counts)))
+        row_ids = np.fromiter((row_id for text in texts for row_id in by_text[text]),
+                              dtype=np.int64, count=int(row_offsets[-1]))
+        del by_text
+
+        # (trigram << 32 | text) pairs: one sort orders the postings, then
+        # repeats of a trigram within a text are dropped
+        pairs = [np.zeros(0, dtype=np.uint64)]
+        for first in range(0, len(texts), BUILD_CHUNK):
+            chunk = texts[first:first + BUILD_CHUNK]
+            keys, numbers = _trigram_keys(SEPARATOR.join(PAD_START + text + PAD_END for text in chunk))
+            pairs.append((keys << np.uint64(32)) | (numbers + np.uint64(first)))
+        pairs = np.concatenate(pairs)
+        pairs.sort()
+        if len(pairs):
+            pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        all_keys = pairs >> np.uint64(32)
+        postings = (pairs & np.uint64(0xFFFFFFFF)).astype(np.int32)
+        del pairs
+        boundaries = np.flatnonzero(np.diff(all_keys)) + 1
+        gram_offsets = np.concatenate(([0], boundaries, [len(all_keys)])).astype(np.int64)
+        gram_keys = all_keys[gram_offsets[:-1]] if len(all_keys) else np.zeros(0, dtype=np.uint64)
+        del all_keys
+
+        with self._lock:
+            self.corpus = SEPARATOR.join(texts)
+            self.offsets = offsets
+            self.lengths = lengths
+            self.row_offsets = row_offsets
+            self.row_ids = row_ids
+            self.gram_keys = gram_keys
+            self.gram_offsets = gram_offsets
+            self.postings = postings
+        print(f"🔤 Fuzzy index built for {self.project}: {len(texts)} texts, {len(gram_keys)} trigrams, "
+              f"{len(postings)} postings in {time.perf_counter() - start:.1f}s")
+
+    def search(self, query, min_score=MIN_SCORE, limit=MAX_MATCHES):
+        """([(score, row ids)] of texts within min_score percent of query best first, candidates scored).
+
+        Texts sharing no trigram with the query are never returned.
+        """
+        self.ensure_built()
+        query = normalize(query)
+        with self._lock:
+            gram_keys, gram_offsets, postings = self.gram_keys, self.gram_offsets, self.postings
+            corpus, offsets, lengths = self.corpus, self.offsets, self.lengths
+            row_offsets, row_ids = self.row_offsets, self.row_ids
+        if not query or not len(lengths):
+            return [], 0
+
+        query_keys = _query_keys(query)
+        slots = np.searchsorted(gram_keys, query_keys)
+        slots = slots[slots < len(gram_keys)]
+        slots = slots[np.isin(gram_keys[slots], query_keys)]
+        if not len(slots):
+            return [], 0
+
+        # Only texts between len(query) * ratio and len(query) / ratio long can
+        # reach min_score; texts are numbered by length and postings are sorted,
+        # so each posting list is cut to that range before counting
+        ratio = min_score / 100
+        first = int(np.searchsorted(lengths, np.ceil(len(query) * ratio - ROUNDING), side='left'))
+        end = int(np.searchsorted(lengths, np.floor(len(query) / ratio + ROUNDING), side='right'))
+        # Same dtype as the postings, or searchsorted converts every list
+        bounds = np.array([first, end], dtype=postings.dtype)
+        hits = []
+        for slot in slots:
+            posting = postings[gram_offsets[slot]:gram_offsets[slot + 1]]
+            low, high = np.searchsorted(posting, bounds)
+            hits.append(posting[low:high])
+        shared = np.bincount(np.concatenate(hits) - first, minlength=end - first)
+
+        # The longest text in range caps the edits, and so the trigrams every
+        # candidate must share (each edit breaks at most three)
+        most_edits = int((1 - ratio) * len(query) / ratio + ROUNDING)
+        candidates = np.flatnonzero(shared >= max(len(query_keys) - 3 * most_edits, 1))
+        # Then the same bounds per text, with the edits its own length allows
+        candidate_lengths = lengths[candidates + first]
+        max_edits = np.floor((1 - ratio) * np.maximum(candidate_lengths, len(query)) + ROUNDING).astype(np.int64)
+        keep = ((np.abs(candidate_lengths - len(query)) <= max_edits)
+                & (shared[candidates] >= len(query_keys) - 3 * max_edits))
+        candidates = candidates[keep]
+        if len(candidates) > MAX_CANDIDATES:
+            # Most shared trigrams first, ties to the texts closest in length
+            length_gaps = np.abs(candidate_lengths[keep] - len(query))
+            priority = shared[candidates].astype(np.int64) * (int(length_gaps.max()) + 1) - length_gaps
+            best = np.argpartition(-priority, MAX_CANDIDATES - 1)[:MAX_CANDIDATES]
+            candidates = np.sort(candidates[best])
+        candidates += first
+
+        scored = []
+        for number in candidates:
+            text = corpus[offsets[number]:offsets[number] + lengths[number]]
+            longest = max(len(text), len(query))
+            score = 100.0 * (1 - levenshtein_distance(query, text) / longest)
+            if score >= min_score:
+                scored.append((round(score, 1), int(number)))
+        scored.sort(key=lambda match: (-match[0], match[1]))
+        return [(score, row_ids[row_offsets[number]:row_offsets[number + 1]])
+                for score, number in scored[:limit]], len(candidates)
+
+
+def find_fuzzy_matches(text, min_score=None, limit=None, exclude_str_id=None, project=None):
+    """Translation-memory lookup: existing Italian translations of EN texts close to text.
+
+    Returns {'matches': [{score, en_text, translations: [{it_text, str_ids, count}]}],
+    'candidates', 'seconds'}; matched texts without any translation are skipped.
+    Raises ValueError for a min_score outside (0, 100].
+    """
+    min_score = MIN_SCORE if min_score is None else min_score
+    if not 0 < min_score <= 100:
+        raise ValueError('min_score must be between 0 and 100')
+    limit = min(max(limit or MAX_MATCHES, 1), MAX_LIMIT)
+
+    start = time.perf_counter()
+    index = get_fuzzy_index(project)
+    # Texts without a translation are dropped below, so look a little further
+    scored, candidates = index.search(text, min_score, limit * 2)
+
+    numbers = {}
+    row_ids = []
+    for number, (_, rows) in enumerate(scored):
+        rows = [int(row_id) for row_id in rows[:MAX_ROWS_PER_TEXT]]
+        numbers.update((row_id, number) for row_id in rows)
+        row_ids.extend(rows)
+
+    by_number = {}
+    conn = get_connection(project)
+    try:
+        cursor = conn.cursor()
+        for i in range(0, len(row_ids), ID_CHUNK):
+            chunk = row_ids[i:i + ID_CHUNK]
+            placeholders = ','.join(['?' for _ in chunk])
+            cursor.execute(f'''
+                SELECT id, str_id, en_text, it_text
+                FROM translations
+                WHERE id IN ({placeholders})
+                ORDER BY id
+            ''', chunk)
+            for row_id, str_id, en_text, it_text in cursor.fetchall():
+                if str_id == exclude_str_id:
+                    continue
+                entry = by_number.setdefault(numbers[row_id], {'en_text': en_text, 'translations': {}})
+                if it_text and it_text.strip():
+                    translation = entry['translations'].setdefault(it_text, {'it_text': it_text, 'str_ids': [], 'count': 0})
+                    translation['str_ids'].append(str_id)
+                    translation['count'] += 1
+    finally:
+        conn.close()
+
+    matches = []
+    for number, (score, _) in enumerate(scored):
+        entry = by_number.get(number)
+        if not entry or not entry['translations']:
+            continue
+        translations = sorted(entry['translations'].values(), key=lambda translation: -translation['count'])
+        matches.append({'score': score, 'en_text': entry['en_text'], 'translations': translations})
+        if len(matches) >= limit:
+            break
+
+    return {
+        'matches': matches,
+        'candidates': candidates,
+        'seconds': round(time.perf_counter() - start, 4)
+    }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_fuzzy_index(project=None):
+    """The resident fuzzy index of a project (the current one by default)"""
+    project = project or current_project()
+    with _indexes_lock:
+        if project not in _indexes:
+            _indexes[project] = FuzzyIndex(project)
+        return _indexes[project]
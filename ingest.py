@@ -0,0 +1,181 @@
+import pandas as pd
+from openpyxl import load_workbook
+
+# Expected columns: strID, EN, IT (adjust as needed)
+REQUIRED_COLUMNS = ['字符串', 'EN', 'Italian']
+
+# Rows per executemany batch - keeps memory flat regardless of sheet size
+CHUNK_SIZE = 5000
+
+
+def _cell_text(value):
+    """Convert a cell value to the text stored in the database"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value != value:  # NaN from the pandas fallback
+        return ''
+    return str(value)
+
+
+def _column_positions(header):
+    """Find the index of each required column in the header row"""
+    header = [str(col).strip() if col is not None else '' for col in header]
+    if not all(col in header for col in REQUIRED_COLUMNS):
+        raise ValueError(f'Excel must contain columns: {REQUIRED_COLUMNS}')
+    return [header.index(col) for col in REQUIRED_COLUMNS]
+
+
+def _iter_chunks(rows, positions, chunk_size, on_close=None):
+    """Group raw sheet rows into lists of (str_id, en_text, it_text) tuples"""
+    str_pos, en_pos, it_pos = positions
+    width = max(positions) + 1
+    chunk = []
+    try:
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            str_id, en_text, it_text = row[str_pos], row[en_pos], row[it_pos]
+            # Skip fully empty rows (read-only sheets often report trailing blanks)
+            if str_id is None and en_text is None and it_text is None:
+                continue
+
+            chunk.append((_cell_text(str_id), _cell_text(en_text), _cell_text(it_text)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+    finally:
+        if on_close:
+            on_close()
+
+
+def read_excel_chunks(file, filename, chunk_size=CHUNK_SIZE):
+    """Stream the first sheet of an uploaded Excel file in fixed-size chunks.
+
+    The header is validated eagerly (ValueError if a required column is
+    missing), the rows themselves are only read as the chunks are consumed.
+    """
+    if filename.lower().endswith('.xls'):
+        # openpyxl can't read legacy .xls, fall back to pandas for those
+        df = pd.read_excel(file, dtype=object)
+        positions = _column_positions(df.columns)
+        return _iter_chunks(df.itertuples(index=False, name=None), positions, chunk_size)
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+
+    try:
+        positions = _column_positions(next(rows, ()))
+    except ValueError:
+        workbook.close()
+        raise
+
+    return _iter_chunks(rows, positions, chunk_size, on_close=workbook.close)
+
+
+def insert_translation_chunks(cursor, chunks, session_id):
+    """Bulk insert streamed chunks with executemany, returns the row count.
+
+    Committing is left to the caller so the whole upload is one transaction.
+    """
+    total = 0
+    for chunk in chunks:
+        cursor.executemany('''
+            INSERT INTO translations (str_id, en_text, it_text, original_it_text, upload_session)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(str_id, en_text, it_text, it_text, session_id) for str_id, en_text, it_text in chunk])
+        total += len(chunk)
+        print(f"📥 Inserted {total} rows...")
+    return total
+
+
+def merge_translation_chunks(cursor, chunks, session_id):
+    """Apply streamed chunks on top of the existing rows, matched by str_id.
+
+    New strings are inserted, strings missing from the file are retired
+    (deleted) and changed EN/Italian text is updated. Rows the user already
+    edited keep their it_text - only the original they are compared to moves.
+    Returns the counts plus the str_ids whose EN text is new or changed, which
+    is all the similarity data that needs recomputing.
+    """
+    cursor.execute('DROP TABLE IF EXISTS temp.upload_staging')
+    cursor.execute('''
+        CREATE TEMP TABLE upload_staging (
+            row_order INTEGER PRIMARY KEY,
+            str_id TEXT UNIQUE,
+            en_text TEXT,
+            it_text TEXT
+        )
+    ''')
+
+    total = 0
+    for chunk in chunks:
+        # Duplicate str_ids in the sheet: the last occurrence wins
+        cursor.executemany('''
+            INSERT OR REPLACE INTO upload_staging (str_id, en_text, it_text)
+            VALUES (?, ?, ?)
+        ''', chunk)
+        total += len(chunk)
+        print(f"📥 Staged {total} rows...")
+
+    # EN text that changed (or is new) is what similarity data depends on
+    cursor.execute('''
+        SELECT s.str_id
+        FROM upload_staging s
+        LEFT JOIN translations t ON t.str_id = s.str_id
+        WHERE t.id IS NULL OR t.en_text IS NOT s.en_text
+    ''')
+    delta_ids = [row[0] for row in cursor.fetchall()]
+
+    # Retire rows that are no longer in the file
+    cursor.execute('''
+        DELETE FROM translations
+        WHERE str_id NOT IN (SELECT str_id FROM upload_staging)
+    ''')
+    retired = cursor.rowcount
+
+    # Update changed rows, keeping the user's edit where there is one
+    cursor.execute('''
+        UPDATE translations
+        SET en_text = (SELECT s.en_text FROM upload_staging s WHERE s.str_id = translations.str_id),
+            it_text = CASE WHEN is_modified = 1 THEN it_text
+                           ELSE (SELECT s.it_text FROM upload_staging s WHERE s.str_id = translations.str_id)
+                      END,
+            original_it_text = (SELECT s.it_text FROM upload_staging s WHERE s.str_id = translations.str_id),
+            upload_session = ?
+        WHERE EXISTS (
+            SELECT 1 FROM upload_staging s
+            WHERE s.str_id = translations.str_id
+              AND (s.en_text IS NOT translations.en_text OR s.it_text IS NOT translations.original_it_text)
+        )
+    ''', (session_id,))
+    updated = cursor.rowcount
+
+    # An edit that now matches the new original is no longer a modification
+    cursor.execute('''
+        UPDATE translations
+        SET is_modified = 0
+        WHERE is_modified = 1 AND it_text IS original_it_text
+    ''')
+
+    cursor.execute('''
+        INSERT INTO translations (str_id, en_text, it_text, original_it_text, upload_session)
+        SELECT s.str_id, s.en_text, s.it_text, s.it_text, ?
+        FROM upload_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM translations t WHERE t.str_id = s.str_id)
+        ORDER BY s.row_order
+    ''', (session_id,))
+    inserted = cursor.rowcount
+
+    cursor.execute('DROP TABLE temp.upload_staging')
+
+    return {
+        'total': total,
+        'inserted': inserted,
+        'updated': updated,
+        'retired': retired,
+        'delta_ids': delta_ids
+    }
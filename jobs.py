@@ -0,0 +1,258 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Worker threads shared by all background jobs
+JOB_WORKERS = int(os.environ.get('LOCZ_JOB_WORKERS', 2))
+# Finished jobs kept around for the jobs API
+MAX_FINISHED_JOBS = 200
+# Longest a bulk job pauses for interactive queries before carrying on
+MAX_YIELD_SECONDS = 5.0
+# Longest a job waits for the jobs it replaces to stop before giving up
+WAIT_FOR_TIMEOUT = int(os.environ.get('LOCZ_JOB_WAIT_TIMEOUT', 600))
+
+# Lower runs first
+PRIORITY_NORMAL = 10
+PRIORITY_BULK = 20
+
+ACTIVE_STATES = ('queued', 'running')
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at a checkpoint once it has been cancelled"""
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value).isoformat(timespec='seconds') if value else None
+
+
+class Job:
+    """One unit of background work and its progress"""
+
+    def __init__(self, job_id, kind, project, priority, target, args, wait_for, scheduler):
+        self.id = job_id
+        self.kind = kind
+        self.project = project
+        self.priority = priority
+        self.target = target
+        self.args = args
+        self.wait_for = list(wait_for)
+        self.scheduler = scheduler
+
+        self.state = 'queued'
+        self.done = 0
+        self.total = 0
+        self.message = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def set_progress(self, done, total=None, message=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        self.scheduler._notify(self)
+
+    def checkpoint(self):
+        """Call between batches: stops a cancelled job and lets interactive work go first"""
+        if self.cancelled:
+            raise JobCancelled()
+        self.scheduler.wait_for_interactive()
+        if self.cancelled:
+            raise JobCancelled()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'project': self.project,
+            'priority': self.priority,
+            'state': self.state,
+            'done': self.done,
+            'total': self.total,
+            'percentage': int(self.done / self.total * 100) if self.total else 0,
+            'message': self.message,
+            'error': self.error,
+            'created_at': _timestamp(self.created_at),
+            'started_at': _timestamp(self.started_at),
+            'finished_at': _timestamp(self.finished_at),
+            'queued_seconds': round((self.started_at or now) - self.created_at, 3),
+            'run_seconds': round((self.finished_at or now) - self.started_at, 3) if self.started_at else 0.0
+        }
+
+
+class JobScheduler:
+    """Bounded worker pool running jobs by priority, then submission order"""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._threads = []
+        self._interactive = 0
+        self._interactive_cond = threading.Condition()
+        self._listeners = []
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, target, args=(), project=None, priority=PRIORITY_NORMAL, wait_for=()):
+        """Queue target(*args, job=job), returns the Job.
+
+        The job doesn't start before every job in wait_for has finished, so a
+        replacement never overlaps the run it supersedes; if one is still
+        running after WAIT_FOR_TIMEOUT the job fails instead.
+        """
+        with self._lock:
+            job = Job(next(self._ids), kind, project, priority, target, args, wait_for, self)
+            self._jobs[job.id] = job
+            self._ensure_workers()
+            self._queue.put((priority, job.id, job))
+        print(f"🗓️ Queued {kind} job {job.id} for {project}")
+        self._notify(job)
+        return job
+
+    def add_listener(self, listener):
+        """Call listener(job) whenever a job changes state or reports progress"""
+        self._listeners.append(listener)
+
+    def _notify(self, job):
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                print(f"⚠️ Job listener failed: {e}")
+
+    def cancel(self, job_id):
+        """Ask a job to stop, returns False if it had already finished"""
+        job = self._jobs.get(job_id)
+        if job is None or job.state not in ACTIVE_STATES:
+            return False
+        job._cancel.set()
+        with self._lock:
+            if job.state == 'queued':
+                # Never started - finish it now so nobody waits on it
+                self._finish(job, 'cancelled')
+        self._notify(job)
+        return True
+
+    def supersede(self, project, kinds):
+        """Cancel the project's unfinished jobs of these kinds.
+
+        Returns every job a replacement has to wait for: the cancelled ones and,
+        since a queued job finishes as soon as it's cancelled, whatever it was
+        still waiting for itself.
+        """
+        superseded = [job for job in self.list_jobs(project)
+                      if job.kind in kinds and job.state in ACTIVE_STATES]
+        for job in superseded:
+            self.cancel(job.id)
+            print(f"🛑 Cancelled {job.kind} job {job.id}, superseded by a newer upload")
+        # The list grows while it's walked, so older chains are followed too
+        for job in superseded:
+            for earlier in job.wait_for:
+                if earlier.state in ACTIVE_STATES and earlier not in superseded:
+                    superseded.append(earlier)
+        return superseded
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, project=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if project is None or job.project == project]
+
+    @contextmanager
+    def interactive(self):
+        """Wrap work a user is waiting for - bulk jobs pause at their next checkpoint"""
+        with self._interactive_cond:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._interactive_cond:
+                self._interactive -= 1
+                self._interactive_cond.notify_all()
+
+    def wait_for_interactive(self):
+        with self._interactive_cond:
+            self._interactive_cond.wait_for(lambda: self._interactive == 0, timeout=MAX_YIELD_SECONDS)
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished_at = time.time()
+        job._finished.set()
+
+        finished = [j for j in self._jobs.values() if j.state not in ACTIVE_STATES]
+        for old in sorted(finished, key=lambda j: j.id)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[old.id]
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            deadline = time.monotonic() + WAIT_FOR_TIMEOUT
+            stuck = [earlier for earlier in job.wait_for
+                     if not earlier.wait(max(0, deadline - time.monotonic()))]
+            if stuck:
+                # Running alongside a hung predecessor would mix up their writes;
+                # the next upload or restart tries again
+                error = f"{stuck[0].kind} job {stuck[0].id} did not stop within {WAIT_FOR_TIMEOUT}s"
+                with self._lock:
+                    if job.state == 'queued':
+                        self._finish(job, 'failed', error)
+                self._notify(job)
+                print(f"❌ {job.kind} job {job.id} failed: {error}")
+                continue
+
+            with self._lock:
+                if job.state != 'queued':
+                    continue
+                if job.cancelled:
+                    self._finish(job, 'cancelled')
+                    continue
+                job.state = 'running'
+                job.started_at = time.time()
+            self._notify(job)
+
+            try:
+                job.target(*job.args, job=job)
+                state, error = ('cancelled' if job.cancelled else 'completed'), None
+            except JobCancelled:
+                state, error = 'cancelled', None
+            except Exception as e:
+                print(f"❌ {job.kind} job {job.id} failed: {e}")
+                state, error = 'failed', str(e)
+
+            with self._lock:
+                self._finish(job, state, error)
+            self._notify(job)
+            print(f"🗓️ {job.kind} job {job.id} {state} in {job.finished_at - job.started_at:.1f}s")
+
+
+job_scheduler = JobScheduler()
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+from projects import current_project
+
+# Every Nth row id of a filtered listing is remembered, so any page is at most
+# this many rows away from a seek point
+ANCHOR_EVERY = 1000
+MAX_CACHED_FILTERS = 128
+
+# Per project, so edits in one project keep the others' counts cached
+_data_versions = {}
+_lock = threading.Lock()
+_page_maps = OrderedDict()
+
+
+def bump_data_version(project=None):
+    """Call after committing any change to translations - drops cached counts"""
+    project = project or current_project()
+    with _lock:
+        _data_versions[project] = _data_versions.get(project, 0) + 1
+        for key in [key for key in _page_maps if key[0] == project]:
+            del _page_maps[key]
+
+
+def get_data_version(project=None):
+    return _data_versions.get(project or current_project(), 0)
+
+
+def _page_map(cursor, where_clause, params):
+    """(total, anchors) for a filter, where anchors[k] is the id at row k * ANCHOR_EVERY"""
+    project = current_project()
+    version = get_data_version(project)
+    key = (project, where_clause, tuple(params), version)
+
+    with _lock:
+        if key in _page_maps:
+            _page_maps.move_to_end(key)
+            return _page_maps[key]
+
+    # One pass gives both the count and the seek points
+    cursor.execute(f'''
+        SELECT pos, id, total FROM (
+            SELECT id,
+                   ROW_NUMBER() OVER (ORDER BY id) - 1 AS pos,
+                   COUNT(*) OVER () AS total
+            FROM translations {where_clause}
+        )
+        WHERE pos % ? = 0
+        ORDER BY pos
+    ''', list(params) + [ANCHOR_EVERY])
+    rows = cursor.fetchall()
+    page_map = (rows[0][2] if rows else 0, [row[1] for row in rows])
+
+    with _lock:
+        if version == get_data_version(project):
+            _page_maps[key] = page_map
+            while len(_page_maps) > MAX_CACHED_FILTERS:
+                _page_maps.popitem(last=False)
+    return page_map
+
+
+def count_rows(cursor, where_clause, params):
+    """Filtered row count, cached until the data changes"""
+    return _page_map(cursor, where_clause, params)[0]
+
+
+def fetch_page(cursor, columns, where_clause, params, start, length, after_id=None):
+    """One page of a listing ordered by id, returns (total, rows).
+
+    With after_id (the last id of the previous page) the page is a pure index
+    seek. Otherwise it seeks to the nearest cached anchor and skips fewer than
+    ANCHOR_EVERY rows, so deep pages cost the same as the first one.
+    """
+    total, anchors = _page_map(cursor, where_clause, params)
+
+    if after_id is not None:
+        cursor.execute(f'''
+            SELECT {columns} FROM translations {where_clause} AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', list(params) + [after_id, length])
+        return total, cursor.fetchall()
+
+    block = start // ANCHOR_EVERY
+    if start < 0 or block >= len(anchors):
+        return total, []
+
+    cursor.execute(f'''
+        SELECT {columns} FROM translations {where_clause} AND id >= ?
+        ORDER BY id
+        LIMIT ? OFFSET ?
+    ''', list(params) + [anchors[block], length, start - block * ANCHOR_EVERY])
+    return total, cursor.fetchall()
+
+
+def fetch_ranked_page(cursor, columns, matches, where_clause, params, start, length):
+    """One page of ranked matches in rank order, returns (total, rows).
+
+    matches is [(str_id, score, match_type)] best first. They are loaded into
+    a temp table keyed by rank instead of an IN list, so there is no bound
+    parameter limit and the ranking survives the join; score and match_type
+    are appended to every row. The pool rolls the load back on close().
+    """
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS ranked_matches (
+            rank INTEGER PRIMARY KEY,
+            match_str_id TEXT NOT NULL,
+            score REAL NOT NULL,
+            match_type TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('DELETE FROM ranked_matches')
+    cursor.executemany('INSERT INTO ranked_matches VALUES (?, ?, ?, ?)',
+                       [(rank, str_id, score, match_type) for rank, (str_id, score, match_type) in enumerate(matches)])
+
+    # Rank order drives the join, each match is one lookup on translations.str_id
+    source = 'FROM ranked_matches CROSS JOIN translations ON translations.str_id = ranked_matches.match_str_id'
+    cursor.execute(f'SELECT COUNT(*) {source} {where_clause}', params)
+    total = cursor.fetchone()[0]
+    cursor.execute(f'''
+        SELECT {columns}, score, match_type {source} {where_clause}
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', list(params) + [length, max(start, 0)])
+    return total, cursor.fetchall()
@@ -0,0 +1,91 @@
+import threading
+from db import get_connection
+
+
+def read_embedding_status(cursor):
+    """The latest embedding run: state is running, complete, failed, cancelled or interrupted"""
+    cursor.execute('''
+        SELECT session_id, total_strings, processed_strings, state, error,
+               cache_hits, cache_misses, strings_per_second
+        FROM processing_status
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT 1
+    ''')
+    result = cursor.fetchone()
+    if not result:
+        return None
+    session_id, total, processed, state, error, cache_hits, cache_misses, strings_per_second = result
+    return {
+        'session_id': session_id,
+        'state': state,
+        'error': error,
+        'total': total,
+        'processed': processed,
+        'cache_hits': cache_hits or 0,
+        'cache_misses': cache_misses or 0,
+        'strings_per_second': strings_per_second or 0
+    }
+
+
+class ProgressBoard:
+    """Embedding progress per project, kept in memory and pushed to waiting streams.
+
+    Each project's status is read from processing_status once; after that the
+    embedding run updates it directly, so status requests never hit the table.
+    """
+
+    def __init__(self):
+        self._status = {}
+        self._version = 0
+        self._project_versions = {}
+        self._cond = threading.Condition()
+
+    def _load(self, project):
+        conn = get_connection(project)
+        try:
+            return read_embedding_status(conn.cursor()) or {}
+        finally:
+            conn.close()
+
+    def get(self, project):
+        """(version, status) for a project; the status is a copy"""
+        with self._cond:
+            status = self._status.get(project)
+        if status is None:
+            loaded = self._load(project)
+            with self._cond:
+                status = self._status.setdefault(project, loaded)
+        with self._cond:
+            return self._project_versions.get(project, 0), dict(status)
+
+    def update(self, project, **fields):
+        """Merge fields into a project's status and wake its streams"""
+        with self._cond:
+            status = self._status.get(project)
+        # The fields not given (totals, session) come from the table, like in get()
+        if status is None:
+            loaded = self._load(project)
+        with self._cond:
+            if project not in self._status:
+                self._status[project] = loaded
+            self._status[project].update(fields)
+            self._touch(project)
+
+    def touch(self, project):
+        """Wake a project's streams without changing the status, e.g. on job progress"""
+        with self._cond:
+            self._touch(project)
+
+    def _touch(self, project):
+        self._version += 1
+        self._project_versions[project] = self._version
+        self._cond.notify_all()
+
+    def wait(self, project, since, timeout):
+        """Block until the project changes after version since, returns (version, status) or None"""
+        with self._cond:
+            changed = self._cond.wait_for(lambda: self._project_versions.get(project, 0) > since, timeout)
+        return self.get(project) if changed else None
+
+
+progress_board = ProgressBoard()
@@ -0,0 +1,73 @@
+import contextvars
+import os
+import re
+
+# The default project keeps using translations.db, where everything lived
+# before projects existed
+DEFAULT_PROJECT = 'default'
+PROJECTS_DIR = os.environ.get('LOCZ_PROJECTS_DIR', 'projects')
+
+# Where the browser keeps its selection; ?project= or the header override it
+PROJECT_COOKIE = 'locz_project'
+PROJECT_HEADER = 'X-LocZ-Project'
+
+_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+_current_project = contextvars.ContextVar('current_project', default=DEFAULT_PROJECT)
+
+
+def is_valid_project_name(name):
+    return isinstance(name, str) and bool(_NAME_RE.match(name))
+
+
+def project_path(project, suffix='.db'):
+    """Path of a project's database shard, or of a sidecar file next to it"""
+    if project == DEFAULT_PROJECT:
+        return 'translations' + suffix
+    return os.path.join(PROJECTS_DIR, project + suffix)
+
+
+def project_exists(project):
+    return project == DEFAULT_PROJECT or os.path.exists(project_path(project))
+
+
+def list_projects():
+    names = set()
+    if os.path.isdir(PROJECTS_DIR):
+        names = {name[:-3] for name in os.listdir(PROJECTS_DIR)
+                 if name.endswith('.db') and is_valid_project_name(name[:-3])}
+    names.discard(DEFAULT_PROJECT)
+    return [DEFAULT_PROJECT] + sorted(names)
+
+
+def prepare_project(name):
+    """Validate a new project name and make room for its shard, ValueError if invalid"""
+    if not is_valid_project_name(name):
+        raise ValueError('Project names are 1-64 letters, digits, "-" or "_"')
+    os.makedirs(PROJECTS_DIR, exist_ok=True)
+    return name
+
+
+def use_project(project):
+    """Make project the default for database access in this thread"""
+    _current_project.set(project)
+
+
+def current_project():
+    return _current_project.get()
+
+
+def project_from_request(request):
+    """Project named by the request, or None when it names one that doesn't exist.
+
+    An explicit ?project= or header must exist; a stale cookie falls back to
+    the default project.
+    """
+    explicit = request.args.get('project') or request.headers.get(PROJECT_HEADER)
+    if explicit:
+        return explicit if is_valid_project_name(explicit) and project_exists(explicit) else None
+
+    selected = request.cookies.get(PROJECT_COOKIE)
+    if selected and is_valid_project_name(selected) and project_exists(selected):
+        return selected
+    return DEFAULT_PROJECT
@@ -0,0 +1,103 @@
+import re
+from search_index import column_contains_clause, should_reindex, suspend_search_index, resume_search_index
+
+# Candidate rows fetched and rewritten per round trip
+CHUNK_SIZE = 2000
+PREVIEW_SAMPLES = 20
+
+
+def compile_pattern(search_text, case_sensitive=False, whole_word=False):
+    """One compiled regex for the whole run"""
+    pattern = re.escape(search_text)
+    if whole_word:
+        pattern = r'\b' + pattern + r'\b'
+    return re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+
+
+def iter_replacement_chunks(cursor, search_text, replace_text, case_sensitive=False,
+                            whole_word=False, chunk_size=CHUNK_SIZE):
+    """Yield (scanned, changes) per chunk of candidate rows.
+
+    Only rows the index says may contain search_text are read, a keyset
+    page at a time. changes is a list of (id, old_text, new_text,
+    original_text, match_count). The replacement is inserted literally.
+    """
+    pattern = compile_pattern(search_text, case_sensitive, whole_word)
+    where, params = column_contains_clause('it_text', search_text, case_sensitive)
+
+    def literal(match):
+        return replace_text
+
+    last_id = 0
+    while True:
+        cursor.execute(f'''
+            SELECT id, it_text, original_it_text FROM translations
+            WHERE {where} AND id > ? AND it_text != ''
+            ORDER BY id
+            LIMIT ?
+        ''', params + [last_id, chunk_size])
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+
+        changes = []
+        for row_id, text, original in rows:
+            new_text, count = pattern.subn(literal, text)
+            if count and new_text != text:
+                changes.append((row_id, text, new_text, original, count))
+        yield len(rows), changes
+
+
+def apply_replace_all(cursor, search_text, replace_text, case_sensitive=False,
+                      whole_word=False, store_undo=False):
+    """Rewrite every matching it_text with chunked executemany; the caller commits.
+
+    When a replace touches a large share of the table, re-indexing it once is
+    cheaper than the per-row FTS triggers, so those are suspended meanwhile.
+    Returns (updated_rows, before_images); before_images lists
+    (id, old_text, old_is_modified) when store_undo is set, else None.
+    """
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+
+    updates = []
+    updated_rows = []
+    before_images = [] if store_undo else None
+    for _, changes in iter_replacement_chunks(cursor, search_text, replace_text, case_sensitive, whole_word):
+        for row_id, text, new_text, original, _ in changes:
+            is_modified = 1 if new_text != original else 0
+            updates.append((new_text, is_modified, row_id))
+            updated_rows.append({'id': row_id, 'new_text': new_text, 'is_modified': is_modified})
+            if store_undo:
+                before_images.append((row_id, text, 1 if text != original else 0))
+    if not updates:
+        return updated_rows, before_images
+
+    reindex = should_reindex(cursor, len(updates))
+    if reindex:
+        suspend_search_index(cursor)
+    for i in range(0, len(updates), CHUNK_SIZE):
+        cursor.executemany('UPDATE translations SET it_text = ?, is_modified = ? WHERE id = ?',
+                           updates[i:i + CHUNK_SIZE])
+    if reindex:
+        resume_search_index(cursor)
+    return updated_rows, before_images
+
+
+def iter_replace_preview(cursor, search_text, replace_text, case_sensitive=False,
+                         whole_word=False, samples=PREVIEW_SAMPLES):
+    """Dry run - yields progress dicts per chunk, sample diffs, then a summary. Writes nothing"""
+    scanned = matched_rows = matches = 0
+    sent = 0
+    for chunk_scanned, changes in iter_replacement_chunks(cursor, search_text, replace_text, case_sensitive, whole_word):
+        scanned += chunk_scanned
+        matched_rows += len(changes)
+        matches += sum(change[4] for change in changes)
+        yield {'scanned': scanned, 'matched_rows': matched_rows, 'matches': matches}
+
+        for row_id, text, new_text, _, count in changes[:samples - sent]:
+            yield {'sample': {'id': row_id, 'before': text, 'after': new_text, 'matches': count}}
+            sent += 1
+
+    yield {'done': True, 'scanned': scanned, 'matched_rows': matched_rows, 'matches': matches}
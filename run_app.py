@@ -1,7 +1,7 @@
 import threading
 import time
 import webbrowser
-from app import app
+from app import app, start_background_work
 
 def open_browser():
     """Open browser after a short delay"""
@@ -22,6 +22,7 @@ def main():
     
     # Start Flask app
     try:
+        start_background_work()
         app.run(host='127.0.0.1', port=5000, debug=False, use_reloader=False)
     except KeyboardInterrupt:
         print("\n👋 ALT File Editor stopped.")
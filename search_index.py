@@ -0,0 +1,141 @@
+import sqlite3
+
+# Trigram tokens need at least this many characters to match anything
+MIN_FTS_QUERY = 3
+# Above this share of rows changed, rebuilding the index once beats the triggers
+REINDEX_FRACTION = 0.1
+
+_fts_available = False
+
+
+def _create_triggers(cursor):
+    """Triggers mirroring every text change on translations into the index"""
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS translations_fts_insert AFTER INSERT ON translations BEGIN
+            INSERT INTO translations_fts (rowid, str_id, en_text, it_text)
+            VALUES (new.id, new.str_id, new.en_text, new.it_text);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS translations_fts_delete AFTER DELETE ON translations BEGIN
+            INSERT INTO translations_fts (translations_fts, rowid, str_id, en_text, it_text)
+            VALUES ('delete', old.id, old.str_id, old.en_text, old.it_text);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS translations_fts_update AFTER UPDATE OF str_id, en_text, it_text ON translations BEGIN
+            INSERT INTO translations_fts (translations_fts, rowid, str_id, en_text, it_text)
+            VALUES ('delete', old.id, old.str_id, old.en_text, old.it_text);
+            INSERT INTO translations_fts (rowid, str_id, en_text, it_text)
+            VALUES (new.id, new.str_id, new.en_text, new.it_text);
+        END
+    ''')
+
+
+def init_search_index(cursor):
+    """Create the FTS5 trigram index over translations and its sync triggers.
+
+    The index is external-content (it stores no copy of the text) and the
+    triggers keep it in sync with every insert, delete and text update, so
+    uploads, edits, replace and undo need no extra bookkeeping. Returns False
+    when this SQLite build has no FTS5/trigram support.
+    """
+    global _fts_available
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'translations_fts'")
+    exists = cursor.fetchone() is not None
+
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS translations_fts USING fts5(
+                str_id, en_text, it_text,
+                content='translations', content_rowid='id',
+                tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ Full-text search unavailable, falling back to LIKE: {e}")
+        _fts_available = False
+        return False
+
+    _create_triggers(cursor)
+
+    # Index rows that were there before the index existed
+    if not exists:
+        cursor.execute("INSERT INTO translations_fts (translations_fts) VALUES ('rebuild')")
+
+    _fts_available = True
+    return True
+
+
+def suspend_search_index(cursor):
+    """Drop the sync triggers ahead of a full reload of the translations table.
+
+    Opens a transaction first, so if the upload fails the rollback brings the
+    triggers back. Call resume_search_index before committing.
+    """
+    if not _fts_available:
+        return
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN')
+    cursor.execute('DROP TRIGGER IF EXISTS translations_fts_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS translations_fts_delete')
+    cursor.execute('DROP TRIGGER IF EXISTS translations_fts_update')
+
+
+def resume_search_index(cursor):
+    """Recreate the triggers and re-index the whole table in one pass"""
+    if not _fts_available:
+        return
+    _create_triggers(cursor)
+    cursor.execute("INSERT INTO translations_fts (translations_fts) VALUES ('rebuild')")
+
+
+def should_reindex(cursor, changed_rows):
+    """True when a bulk update is big enough to suspend the triggers for"""
+    if not _fts_available:
+        return False
+    cursor.execute('SELECT COUNT(*) FROM translations')
+    return changed_rows > cursor.fetchone()[0] * REINDEX_FRACTION
+
+
+def fts_phrase(text):
+    """Quote text as one FTS5 phrase - with trigrams that's a substring match"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search_clause(search_value):
+    """WHERE fragment and params for the table search box.
+
+    Substring matches on str_id, EN and Italian text, case-insensitive like
+    the LIKE filter it replaces. Queries shorter than a trigram use LIKE.
+    """
+    if _fts_available and len(search_value) >= MIN_FTS_QUERY:
+        return "id IN (SELECT rowid FROM translations_fts WHERE translations_fts MATCH ?)", [fts_phrase(search_value)]
+
+    search_param = f'%{search_value}%'
+    return "(str_id LIKE ? OR en_text LIKE ? OR it_text LIKE ?)", [search_param, search_param, search_param]
+
+
+def like_pattern(text):
+    """LIKE pattern matching text anywhere, with wildcards escaped (ESCAPE '\\')"""
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def column_contains_clause(column, text, case_sensitive=False):
+    """WHERE fragment and params narrowing rows to those whose column may contain text.
+
+    Used as a prefilter - it can return extra rows (the FTS index ignores
+    case) but never misses one, so callers still verify each match.
+    """
+    if _fts_available and len(text) >= MIN_FTS_QUERY:
+        return (
+            "id IN (SELECT rowid FROM translations_fts WHERE translations_fts MATCH ?)",
+            [f'{column} : {fts_phrase(text)}']
+        )
+    if case_sensitive:
+        return f"instr({column}, ?) > 0", [text]
+    # LIKE only folds ASCII case, so it can't safely narrow anything else
+    if text.isascii():
+        return f"{column} LIKE ? ESCAPE '\\'", [like_pattern(text)]
+    return "1=1", []
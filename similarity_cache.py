@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Ranked result lists kept across DataTables page, sort and redraw requests
+MAX_CACHED_SEARCHES = int(os.environ.get('LOCZ_SIMILARITY_CACHE_SIZE', 256))
+CACHE_TTL_SECONDS = int(os.environ.get('LOCZ_SIMILARITY_CACHE_TTL', 600))
+
+
+class SimilarityCache:
+    """LRU of similarity search results per project, query and index version.
+
+    The version changes whenever the searched vectors do, so a stale entry is
+    never returned; invalidate() just frees a project's entries early, e.g.
+    on upload. Entries also expire after CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_SEARCHES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached results for key (project first), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, results):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, project):
+        """Drop every entry of a project"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == project]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+similarity_cache = SimilarityCache()
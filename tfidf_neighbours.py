@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+TOP_K = 5
+MIN_SCORE = 0.3
+
+# Upper bound for one dense chunk x n score block
+CHUNK_BUDGET_BYTES = 256 * 1024 * 1024
+MAX_CHUNK_ROWS = 4096
+
+# Worker processes for the chunk products, 1 = run in the calling thread
+TFIDF_WORKERS = int(os.environ.get('LOCZ_TFIDF_WORKERS', 1))
+
+_worker_matrix = None
+
+
+def _init_worker(matrix):
+    global _worker_matrix
+    _worker_matrix = matrix
+
+
+def _topk_block(matrix, query_rows, k):
+    """Top-k neighbours for a chunk of rows, best first"""
+    # Sparse x sparse product, densified only for this chunk
+    block = (matrix[query_rows] @ matrix.T).toarray()
+    # A string is never its own neighbour
+    block[np.arange(len(query_rows)), query_rows] = -1.0
+
+    k = min(k, block.shape[1] - 1)
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(block, top, axis=1)
+
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return (
+        query_rows,
+        np.take_along_axis(top, order, axis=1),
+        np.take_along_axis(top_scores, order, axis=1)
+    )
+
+
+def _topk_worker(args):
+    query_rows, k = args
+    return _topk_block(_worker_matrix, query_rows, k)
+
+
+def chunk_rows_for(n):
+    """Rows per chunk so a chunk x n float32 block stays within budget"""
+    return max(1, min(MAX_CHUNK_ROWS, CHUNK_BUDGET_BYTES // (4 * max(n, 1))))
+
+
+def iter_tfidf_neighbours(tfidf_matrix, query_rows=None, k=TOP_K, workers=TFIDF_WORKERS):
+    """Yield (rows, neighbour_rows, scores) chunk by chunk.
+
+    Rows are L2-normalized TF-IDF vectors, so the dot product is the cosine
+    similarity. Only query_rows are scored (all rows by default), each against
+    the whole matrix; memory is bounded by chunk size x n instead of n x n.
+    """
+    matrix = tfidf_matrix.tocsr().astype(np.float32)
+    n = matrix.shape[0]
+    if n < 2:
+        return
+
+    if query_rows is None:
+        query_rows = np.arange(n)
+    query_rows = np.asarray(query_rows, dtype=np.int64)
+
+    chunk = chunk_rows_for(n)
+    chunks = [query_rows[i:i + chunk] for i in range(0, len(query_rows), chunk)]
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matrix,)) as pool:
+            yield from pool.map(_topk_worker, [(rows, k) for rows in chunks])
+    else:
+        for rows in chunks:
+            yield _topk_block(matrix, rows, k)
@@ -0,0 +1,258 @@
+import os
+import time
+import numpy as np
+from projects import project_path
+from embedding_cache import normalize_text, text_hash, store_embeddings
+from embedding_model import MODEL_ID
+
+# One directory per project next to its shard (translations.vectors for the default)
+VECTOR_DIR_SUFFIX = '.vectors'
+DTYPE = np.float32
+
+# Rewrite a session file once fewer than half of its rows are still referenced
+COMPACT_MIN_DEAD_ROWS = 10000
+COMPACT_DEAD_FRACTION = 0.5
+COPY_CHUNK = 65536
+
+# Precision of the copy searched first: float32 scans the mapped file itself,
+# float16 and int8 keep a smaller copy in memory and the best rows are then
+# rescored against the file
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+QUANTIZATION = os.environ.get('LOCZ_EMBED_QUANTIZATION', 'float32')
+if QUANTIZATION not in QUANTIZATIONS:
+    print(f"⚠️ Unknown LOCZ_EMBED_QUANTIZATION {QUANTIZATION!r}, searching float32")
+    QUANTIZATION = 'float32'
+# Rows widened to float32 at a time while scoring, small enough to stay in cache
+SCAN_CHUNK = 1024
+
+
+def vector_dir(project):
+    return project_path(project, VECTOR_DIR_SUFFIX)
+
+
+def init_vector_store(cursor):
+    """Session files and the row mapping; blobs from before are moved into the embedding cache.
+
+    Call after the embeddings table exists. Migrated strings have no vector
+    row, so the startup resume re-embeds them straight from the cache.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vector_files (
+            session_id TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('PRAGMA table_info(embeddings)')
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'vector_row' not in columns:
+        cursor.execute('ALTER TABLE embeddings ADD COLUMN vector_row INTEGER')
+    if 'embedding' not in columns:
+        return
+
+    cursor.execute('SELECT COUNT(*) FROM embeddings WHERE embedding IS NOT NULL')
+    legacy = cursor.fetchone()[0]
+    if legacy:
+        cursor.execute('''
+            SELECT e.embedding, t.en_text
+            FROM embeddings e
+            JOIN translations t ON t.str_id = e.str_id
+            WHERE e.embedding IS NOT NULL
+        ''')
+        while True:
+            rows = cursor.fetchmany(COPY_CHUNK)
+            if not rows:
+                break
+            store_embeddings(cursor.connection.cursor(), MODEL_ID, {
+                text_hash(normalize_text(en_text), MODEL_ID): np.frombuffer(blob, dtype=DTYPE)
+                for blob, en_text in rows
+            })
+        cursor.execute('DELETE FROM embeddings WHERE embedding IS NOT NULL')
+        print(f"📦 Moved {legacy} stored embeddings into the cache for the vector store")
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=DTYPE)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def get_session_file(cursor, session_id):
+    """(file_name, dim) of a session's vectors, or None"""
+    cursor.execute('SELECT file_name, dim FROM vector_files WHERE session_id = ?', (session_id,))
+    return cursor.fetchone()
+
+
+def open_vectors(project, file_name, dim, rows):
+    """Read-only memory map of the first rows of a session file, no copy"""
+    if not rows:
+        return np.zeros((0, dim), dtype=DTYPE)
+    return np.memmap(os.path.join(vector_dir(project), file_name), dtype=DTYPE, mode='r', shape=(rows, dim))
+
+
+class QuantizedVectors:
+    """Compact copy of normalized vectors for a first, approximate scoring pass.
+
+    float16 halves the size of float32. int8 stores each row as codes scaled
+    by its largest component (max |x| / 127), a quarter of the size plus one
+    float per row. Instances are never modified, extended() returns a new one.
+    """
+
+    def __init__(self, mode, dim, codes=None, scales=None):
+        self.mode = mode
+        self.dim = dim
+        self.codes = codes if codes is not None else np.zeros((0, dim), dtype=self._code_dtype(mode))
+        if mode == 'int8' and scales is None:
+            scales = np.zeros(0, dtype=DTYPE)
+        self.scales = scales
+
+    @staticmethod
+    def _code_dtype(mode):
+        return np.float16 if mode == 'float16' else np.int8
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def extended(self, matrix):
+        """A copy with float32 rows added, read in chunks so a mapped file is paged through once"""
+        codes = [self.codes]
+        scales = [self.scales] if self.scales is not None else None
+        for start in range(0, len(matrix), COPY_CHUNK):
+            chunk = np.asarray(matrix[start:start + COPY_CHUNK], dtype=DTYPE)
+            if self.mode == 'float16':
+                codes.append(chunk.astype(np.float16))
+            else:
+                scale = np.abs(chunk).max(axis=1) / 127.0
+                scale[scale == 0] = 1.0
+                codes.append(np.rint(chunk / scale[:, None]).astype(np.int8))
+                scales.append(scale.astype(DTYPE))
+        return QuantizedVectors(self.mode, self.dim, np.concatenate(codes),
+                                np.concatenate(scales) if scales is not None else None)
+
+    def dot(self, query, rows=None):
+        """Approximate similarity of the rows (all by default) to a normalized float32 query"""
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None or self.scales is None else self.scales[rows]
+        similarities = np.empty(len(codes), dtype=DTYPE)
+        buffer = np.empty((min(SCAN_CHUNK, len(codes)), self.dim), dtype=DTYPE)
+        for start in range(0, len(codes), SCAN_CHUNK):
+            block = codes[start:start + SCAN_CHUNK]
+            widened = buffer[:len(block)]
+            widened[...] = block
+            similarities[start:start + len(block)] = widened @ query
+        if scales is not None:
+            similarities *= scales
+        return similarities
+
+
+class VectorWriter:
+    """Appends normalized rows to a session's file.
+
+    Rows are fsynced before append() returns, so once the caller commits the
+    row numbers they always point at data on disk. A crash between the two
+    only leaves unreferenced rows at the end of the file.
+    """
+
+    def __init__(self, cursor, project, session_id, dim):
+        existing = get_session_file(cursor, session_id)
+        if existing:
+            self.file_name, self.dim = existing
+        else:
+            self.file_name, self.dim = f'{session_id}.f32', dim
+            cursor.execute('INSERT INTO vector_files (session_id, file_name, dim) VALUES (?, ?, ?)',
+                           (session_id, self.file_name, dim))
+
+        os.makedirs(vector_dir(project), exist_ok=True)
+        self.path = os.path.join(vector_dir(project), self.file_name)
+        self.row_bytes = self.dim * np.dtype(DTYPE).itemsize
+        self._file = open(self.path, 'ab')
+        # Drop a row that was only half written when the process died
+        size = self._file.seek(0, os.SEEK_END)
+        if size % self.row_bytes:
+            self._file.truncate(size - size % self.row_bytes)
+
+    def append(self, vectors):
+        """Write vectors, returns the row number of the first one"""
+        matrix = normalize_rows(vectors)
+        first = self._file.seek(0, os.SEEK_END) // self.row_bytes
+        self._file.write(matrix.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return first
+
+    def close(self):
+        self._file.close()
+
+
+def remove_other_sessions(cursor, session_id):
+    """Forget every session's vectors but this one; sweep_vector_files deletes the files after commit"""
+    cursor.execute('DELETE FROM embeddings WHERE upload_session != ?', (session_id,))
+    deleted = cursor.rowcount
+    cursor.execute('DELETE FROM vector_files WHERE session_id != ?', (session_id,))
+    return deleted
+
+
+def sweep_vector_files(cursor, project):
+    """Delete files no session refers to any more"""
+    directory = vector_dir(project)
+    if not os.path.isdir(directory):
+        return
+    cursor.execute('SELECT file_name FROM vector_files')
+    referenced = {row[0] for row in cursor.fetchall()}
+    for name in os.listdir(directory):
+        if name not in referenced:
+            # Still mapped somewhere (Windows won't delete it); the next sweep retries
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError as e:
+                print(f"⚠️ Could not delete vector file {name}: {e}")
+
+
+def compact_session(conn, project, session_id):
+    """Rewrite a session file without the rows nothing points at any more.
+
+    The copy goes to a new file and the mapping switches over in one commit,
+    so a crash at any point leaves a consistent store. Returns True if it ran;
+    the caller then releases the old file and sweeps it with sweep_vector_files.
+    """
+    cursor = conn.cursor()
+    session_file = get_session_file(cursor, session_id)
+    if not session_file:
+        return False
+    file_name, dim = session_file
+    path = os.path.join(vector_dir(project), file_name)
+    file_rows = os.path.getsize(path) // (dim * np.dtype(DTYPE).itemsize)
+
+    cursor.execute('SELECT id, vector_row FROM embeddings WHERE upload_session = ? ORDER BY vector_row',
+                   (session_id,))
+    mapping = cursor.fetchall()
+    dead = file_rows - len(mapping)
+    if dead < COMPACT_MIN_DEAD_ROWS or dead < file_rows * COMPACT_DEAD_FRACTION:
+        return False
+
+    start = time.perf_counter()
+    old = open_vectors(project, file_name, dim, file_rows)
+    new_name = f'{session_id}.{int(time.time() * 1000)}.f32'
+    rows = np.array([vector_row for _, vector_row in mapping], dtype=np.int64)
+    with open(os.path.join(vector_dir(project), new_name), 'wb') as f:
+        for i in range(0, len(rows), COPY_CHUNK):
+            f.write(np.ascontiguousarray(old[rows[i:i + COPY_CHUNK]]).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    del old
+
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.executemany('UPDATE embeddings SET vector_row = ? WHERE id = ?',
+                       [(new_row, embedding_id) for new_row, (embedding_id, _) in enumerate(mapping)])
+    cursor.execute('UPDATE vector_files SET file_name = ? WHERE session_id = ?', (new_name, session_id))
+    conn.commit()
+    print(f"🗜️ Compacted vectors of session {session_id}: {file_rows} -> {len(mapping)} rows "
+          f"in {time.perf_counter() - start:.1f}s")
+    return True